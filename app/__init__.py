@@ -20,6 +20,10 @@ def create_app():
     from app.destiny import api_bp as api
     app.register_blueprint(api)
 
+    # Switch to new manifest versions as soon as they are published
+    from app.destiny import definitions
+    definitions.subscribe()
+
     if os.environ['CLANENV'] == 'prod':
         gunicorn_logger = logging.getLogger('gunicorn.error')
         app.logger.handlers = gunicorn_logger.handlers
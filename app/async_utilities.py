@@ -0,0 +1,94 @@
+import asyncio
+import json
+import aiohttp
+from config import Config
+from app.redis.rate_limiter import THROTTLE_ERROR_CODES, get_rate_limiter, get_throttle_seconds
+from app.utilities import THROTTLE_RETRIES
+from app.utils import log
+
+logger = log.get_logger(__name__)
+
+class AsyncClient(object):
+    """
+    asyncio counterpart to utilities.http_get.
+    Keeps one aiohttp session open and bounds the number of requests in flight with a semaphore,
+    so a single worker process can fan out dozens of activity history / PGCR requests at once.
+    Usage:
+        async with AsyncClient() as client:
+            data = await client.http_get(url)
+    """
+    def __init__(self, concurrency=None, retries=2, backoff_factor=1, status_forcelist=(502, 503, 504)):
+        self.concurrency = concurrency or Config.ASYNC_CONCURRENCY
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.status_forcelist = status_forcelist
+        self.semaphore = None
+        self.session = None
+        self.rate_limiter = get_rate_limiter()
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def open(self):
+        # The semaphore and session have to be created inside the running event loop
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency)
+        self.session = aiohttp.ClientSession(connector=connector, headers=Config.BUNGIE_API_KEY)
+
+    async def close(self):
+        if self.session:
+            await self.session.close()
+            self.session = None
+
+    async def _get(self, url):
+        """Send the request, retrying connection errors and status_forcelist responses with exponential backoff."""
+        attempt = 0
+        while True:
+            await self.rate_limiter.acquire_async()
+            try:
+                async with self.semaphore:
+                    async with self.session.get(url) as response:
+                        if response.status not in self.status_forcelist or attempt >= self.retries:
+                            return await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt >= self.retries:
+                    raise
+
+            await asyncio.sleep(self.backoff_factor * (2 ** attempt))
+            attempt = attempt + 1
+
+    async def http_get(self, url):
+        """Same return values as utilities.http_get: the response data, 1665 for private profiles, or None on error."""
+        for attempt in range(THROTTLE_RETRIES + 1):
+            try:
+                text = await self._get(url)
+            except Exception as e:
+                logger.warning(e)
+                return
+
+            data = json.loads(text)
+
+            throttle_seconds = get_throttle_seconds(data)
+            if not throttle_seconds:
+                break
+
+            self.rate_limiter.throttle(throttle_seconds)
+            if data.get('ErrorCode') not in THROTTLE_ERROR_CODES or attempt == THROTTLE_RETRIES:
+                break
+
+            logger.warning(f'Throttled while fetching {url}. Retrying in {throttle_seconds} seconds.')
+
+        if 'ErrorCode' in data:
+            if data['ErrorCode'] == 1665:
+                logger.debug(f'Private profile {url} - Response: {data}')
+                return 1665
+
+            if data['ErrorCode'] != 1:
+                logger.warning(f'Error fetching {url} - Response: {data}')
+                return
+
+        return data
@@ -2,6 +2,7 @@
 
 from app import utilities
 from app import models
+from app.destiny import cache
 from app.destiny import client
 from app.utils import log
 
@@ -50,10 +51,12 @@ def db_remove_former_clan_members():
         # Delete all weapons for every character
         for char in chars_to_delete:
             models.db.session.query(models.WeaponsData).filter(models.WeaponsData.parent_id==char).delete()
+            models.db.session.query(models.WeaponKillsDaily).filter(models.WeaponKillsDaily.parent_id==char).delete()
             models.db.session.commit()
 
         for char in chars_to_delete:
-            models.db.session.query(models.PostGameCarnageReport).filter(models.PostGameCarnageReport.parent_character==char).delete()
+            # PGCRs are shared with other clan members, so only the character's link to them is removed
+            models.db.session.query(models.PgcrParticipant).filter(models.PgcrParticipant.parent_character==char).delete()
             models.db.session.commit()
 
         for char in chars_to_delete:
@@ -79,6 +82,8 @@ def db_remove_former_clan_members():
         models.db.session.query(models.Players).filter(models.Players.membership_id==member).delete()
         models.db.session.commit()
 
+    cache.invalidate('info', 'roster', 'players', 'weapons', 'collectibles')
+
 def db_update_clan_members():
     """
     Fetch the current clan roster from the API and store the new members in the database.
@@ -103,6 +108,8 @@ def db_update_clan_members():
                 model.db.session.rollback()
                 logger.warning(f'{player_id}:{player_name} Error comitting new clan member to database. Reason: {e}')
 
+    cache.invalidate('roster', 'players')
+
 def db_update_characters():
     """
     Updates the database with all characters in the clan.
@@ -0,0 +1,191 @@
+from datetime import datetime
+import atexit
+import calendar
+from functools import wraps
+from time import time
+import json
+import redis
+from flask import Response, current_app, request
+from app.utils import log
+from config import Config
+
+logger = log.get_logger(__name__)
+
+# Responses are cached per endpoint family. Each family has a generation counter in Redis that is part of every
+# cache key, so the writers invalidate a whole family with a single INCR and old entries simply expire.
+# The generation doubles as the data version for ETags, and the time of the last invalidation is the Last-Modified date.
+GENERATION_KEY = 'cache:generation:{}'
+MODIFIED_KEY = 'cache:modified:{}'
+RESPONSE_KEY = 'cache:response:{}:{}:{}'
+
+class ResponseCache(object):
+    """
+    Cache of serialized JSON responses, stored in Redis with a TTL per family.
+    If Redis is unavailable, responses are cached in this process instead.
+    """
+    def __init__(self, ttls, local_size):
+        self.ttls = ttls
+        self.local_size = local_size
+        self.local = {}
+        self.local_generations = {}
+        self.pending = set()
+        self.last_flush = 0
+        self.__db = redis.Redis(host=Config.redis, port=6379, db=0)
+
+    def get_version(self, family):
+        """Returns (generation, last modified timestamp) of a family, or (None, None) if Redis is unavailable."""
+        try:
+            generation, modified = self.__db.mget(GENERATION_KEY.format(family), MODIFIED_KEY.format(family))
+        except redis.RedisError:
+            return None, None
+        return int(generation) if generation else 0, float(modified) if modified else None
+
+    def get_generation(self, family):
+        return self.get_version(family)[0]
+
+    def get(self, family, path, generation=None):
+        if generation is None:
+            generation = self.get_generation(family)
+        if generation is None:
+            return self.get_local(family, path)
+
+        try:
+            return self.__db.get(RESPONSE_KEY.format(family, generation, path))
+        except redis.RedisError:
+            return self.get_local(family, path)
+
+    def set(self, family, path, body, generation=None):
+        ttl = self.ttls.get(family, 60)
+        if generation is None:
+            generation = self.get_generation(family)
+        if generation is not None:
+            try:
+                self.__db.setex(RESPONSE_KEY.format(family, generation, path), ttl, body)
+                return
+            except redis.RedisError:
+                pass
+        self.set_local(family, path, body, ttl)
+
+    def get_local(self, family, path):
+        key = (family, self.local_generations.get(family, 0), path)
+        entry = self.local.get(key)
+        if not entry:
+            return
+        expires, body = entry
+        if expires < time():
+            del self.local[key]
+            return
+        return body
+
+    def set_local(self, family, path, body, ttl):
+        if len(self.local) >= self.local_size:
+            self.local.clear()
+        self.local[(family, self.local_generations.get(family, 0), path)] = (time() + ttl, body)
+
+    def invalidate(self, *families):
+        """Drop every cached response of the given families."""
+        for family in families:
+            self.local_generations[family] = self.local_generations.get(family, 0) + 1
+            try:
+                pipe = self.__db.pipeline()
+                pipe.incr(GENERATION_KEY.format(family))
+                pipe.set(MODIFIED_KEY.format(family), time())
+                pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f'Failed to invalidate the {family} response cache. Reason: {e}')
+
+    def invalidate_later(self, *families):
+        """
+        Invalidate families at most once every RESPONSE_CACHE_INVALIDATE_INTERVAL seconds, for writers that update
+        one player or match at a time. Families are marked here and invalidated together by flush().
+        """
+        self.pending.update(families)
+        if time() - self.last_flush >= Config.RESPONSE_CACHE_INVALIDATE_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        """Invalidate the families marked by invalidate_later()."""
+        families, self.pending = self.pending, set()
+        self.last_flush = time()
+        if families:
+            self.invalidate(*families)
+
+def to_body(data):
+    """Returns the JSON body of a successful response, or None if the response should not be cached."""
+    if isinstance(data, Response):
+        return data.get_data() if data.status_code == 200 else None
+    if isinstance(data, (dict, list)):
+        return json.dumps(data).encode('utf-8')
+    return
+
+def is_not_modified(etag, modified):
+    if etag and etag in request.if_none_match:
+        return True
+    # If-Modified-Since is only used by clients that did not send an ETag
+    if not request.if_none_match and modified and request.if_modified_since:
+        return int(modified) <= calendar.timegm(request.if_modified_since.utctimetuple())
+    return False
+
+def add_validators(response, etag, modified):
+    if etag:
+        response.set_etag(etag)
+    if modified:
+        response.last_modified = datetime.utcfromtimestamp(int(modified))
+    response.headers['Cache-Control'] = f'public, max-age={Config.RESPONSE_CACHE_MAX_AGE}'
+    return response
+
+def get_day_start():
+    """Timestamp of the start of today, the day the leaderboards over the last X days are counted from."""
+    return datetime.combine(datetime.now().date(), datetime.min.time()).timestamp()
+
+def cached(family, daily=False):
+    """
+    Cache the response of a Resource.get() method, keyed by the request path and query string.
+    Responses carry an ETag and Last-Modified date taken from the family's data version, so a client that already
+    has the current version gets a 304 without the endpoint (or the cache) being read at all.
+    Endpoints over the last X days should pass daily=True: their response also changes when the day rolls over,
+    so the day is part of the cache key and the ETag, and Last-Modified is never before the start of the day.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            generation, modified = response_cache.get_version(family)
+            path = request.full_path
+            etag = f'{family}-{generation}' if generation is not None else None
+            if daily:
+                day_start = get_day_start()
+                day = datetime.fromtimestamp(day_start).strftime('%Y%m%d')
+                path = f'{path}@{day}'
+                etag = f'{etag}-{day}' if etag else None
+                modified = max(modified, day_start) if modified else None
+            if is_not_modified(etag, modified):
+                return add_validators(current_app.response_class(status=304), etag, modified)
+
+            body = response_cache.get(family, path, generation)
+            if body is not None:
+                return add_validators(current_app.response_class(body, mimetype='application/json'), etag, modified)
+
+            data = f(*args, **kwargs)
+            body = to_body(data)
+            if body is None:
+                return data
+
+            response_cache.set(family, path, body, generation)
+            if not isinstance(data, Response):
+                data = current_app.response_class(body, mimetype='application/json')
+            return add_validators(data, etag, modified)
+        return wrapper
+    return decorator
+
+def invalidate(*families):
+    response_cache.invalidate(*families)
+
+def invalidate_later(*families):
+    response_cache.invalidate_later(*families)
+
+def flush():
+    response_cache.flush()
+
+response_cache = ResponseCache(Config.RESPONSE_CACHE_TTL, Config.RESPONSE_CACHE_LOCAL_SIZE)
+# Short-lived jobs exit before their next flush
+atexit.register(flush)
@@ -1,11 +1,19 @@
 from app import models
 from datetime import datetime, timedelta
 from pathlib import Path
+from time import sleep, time
+import asyncio
 import json
 from flask import jsonify
-from sqlalchemy import func
+from sqlalchemy import and_, func
+from sqlalchemy.dialects.postgresql import insert
 from config import Config, ConfigProd
 from app import utilities
+from app.destiny import cache
+from app.destiny import definitions
+from app.destiny import pgcr as pgcr_store
+from app.destiny import weapon_index
+from app.destiny import weapon_registry
 from app.utils import log
 
 logger = log.get_logger(__name__)
@@ -40,33 +48,27 @@ class DestinyAPI(object):
         Test: tests/test_destiny.py/test_get_definition()
         """
 
-        try:
-            table = getattr(models, table)
-        except Exception as e:
-            logger.warning(f'{table} not found in models; cannot look up hash.')
-            return
-
         if convert_hash:
             definition_hash = str(self.get_hash(definition_hash))
         else:
             definition_hash = str(definition_hash)
 
-        query = self.db.session.query(table).filter(table.hash==definition_hash).first()
+        definition = definitions.cache.get(table, definition_hash)
+        if definition is not None:
+            return definition
 
-        if query:
-            return query.json
+        definition = definitions.get_store().get(table, definition_hash)
+
+        if definition:
+            # Missing hashes are not cached, they may show up once the manifest has finished loading
+            definitions.cache.set(table, definition_hash, definition)
+            return definition
         else:
             return
 
     def get_definitions(self, table):
-        """Return all definitions in a table."""
-        try:
-            table = getattr(models, table)
-        except Exception as e:
-            logger.warning(f'{table} not found in models; cannot look up hash.')
-            return
-
-        query = self.db.session.query(table).all()
+        """Return all definitions in a table. Each row has a hash and a json attribute."""
+        query = definitions.get_store().get_all(table)
         if query:
             return query
         else:
@@ -299,26 +301,22 @@ class DestinyAPI(object):
         if category not in valid_categories:
             return
 
-        if days == 0:
-            query = self.db.session.query(models.Weapons.name, models.Weapons.gun_type, models.Weapons.weapon_id, func.sum(models.WeaponsData.kills).label('total_kills')) \
-                .join(models.WeaponsData) \
-                .group_by(models.Weapons.name, models.Weapons.weapon_id, models.Weapons.gun_type) \
-                .filter(models.Weapons.gun_type==category) \
-                .order_by(func.sum(models.WeaponsData.kills).desc())
-
-            results = self.weapon_category_kills_schema.dump(query)
-            return jsonify(results.data)
-
-        time_range = datetime.now() - timedelta(days=days)
-        query = self.db.session.query(models.Weapons.name, models.Weapons.gun_type, models.Weapons.weapon_id, func.sum(models.WeaponsData.kills).label('total_kills')) \
-            .join(models.WeaponsData) \
+        total_kills = func.sum(models.WeaponKillsDaily.kills).label('total_kills')
+        query = self.db.session.query(models.Weapons.name, models.Weapons.gun_type, models.Weapons.weapon_id, total_kills) \
+            .join(models.WeaponKillsDaily) \
             .group_by(models.Weapons.name, models.Weapons.weapon_id, models.Weapons.gun_type) \
             .filter(models.Weapons.gun_type==category) \
-            .filter(models.WeaponsData.match_time >= time_range) \
-            .order_by(func.sum(models.WeaponsData.kills).desc())
+            .order_by(total_kills.desc())
+
+        if days > 0:
+            query = query.filter(models.WeaponKillsDaily.day >= self.get_rollup_start(days))
 
         results = self.weapon_category_kills_schema.dump(query)
         return jsonify(results.data)
+
+    def get_rollup_start(self, days):
+        """First day included in a leaderboard covering the last X days. Rollups are per day, so the whole first day is counted."""
+        return (datetime.now() - timedelta(days=days)).date()
     
     def get_player_kills(self, membership_id, days):
         if days > 0:
@@ -627,55 +625,100 @@ class DestinyAPI(object):
         all_activities = sorted(all_activities, key=lambda x: int(x))
         return all_activities
 
-    def get_raid_stats(self):
+    def get_raid_stats(self, batch_size=1000, rescan=10000):
         """
-        We actually need to loop through all characters in each PGCR. If they're in the clan, continue processing. Skip if not.
+        Add RaidStats rows for raids completed by clan characters since the last run.
+        Work is tracked by a watermark on pgcr_participant, so every run only looks at characters linked to a raid
+        PGCR since the previous one (including characters linked to PGCRs that were already stored).
+        Consumers commit participants out of order, so a row can appear below the watermark after it has moved on.
+        Every run rescans the last `rescan` ids below the watermark; rows that are already stored are skipped.
+        Raids whose activity is not in the Manifest yet are stored without a name and named on a later run.
         """
         start_time = datetime.now()
-        raids = self.db.session.query(models.PostGameCarnageReport).filter(models.PostGameCarnageReport.mode==4).all()
-        print(f'Get all raids query took: ', datetime.now() - start_time)
-        clan_characters = [c.char_id for c in self.db.session.query(models.Characters).all()]
-
-        for raid in raids:
-            activity_hash = raid.data['Response']['activityDetails']['directorActivityHash']
-            try:
-                activity_name = self.get_definition('DestinyActivityDefinition', activity_hash)['displayProperties']['name']
-            except Exception as e:
-                logger.warning(f'Failed to get activity name for {activity_hash}')
-                continue
+        watermark = self.db.session.query(models.Watermark).filter(models.Watermark.name=='raidstats').first()
+        if not watermark:
+            watermark = models.Watermark(name='raidstats', last_id=0)
+            self.db.session.add(watermark)
+
+        self.update_raid_names()
+
+        last_id = max(0, watermark.last_id - rescan)
+        added = 0
+        while True:
+            raids = self.db.session.query(
+                    models.PgcrParticipant.id,
+                    models.PgcrParticipant.parent_character,
+                    models.PostGameCarnageReport.pgcr_id,
+                    models.PgcrEntry.activity_hash,
+                    models.PgcrEntry.completed,
+                    models.PgcrEntry.duration
+                ) \
+                .join(models.PostGameCarnageReport, models.PostGameCarnageReport.id==models.PgcrParticipant.pgcr) \
+                .join(models.Characters, models.Characters.id==models.PgcrParticipant.parent_character) \
+                .join(models.PgcrEntry, and_(models.PgcrEntry.pgcr==models.PgcrParticipant.pgcr, models.PgcrEntry.character_id==models.Characters.char_id)) \
+                .filter(models.PgcrParticipant.id > last_id) \
+                .filter(models.PgcrParticipant.mode==4) \
+                .filter(models.PgcrEntry.completed >= 1) \
+                .order_by(models.PgcrParticipant.id) \
+                .limit(batch_size) \
+                .all()
+            if not raids:
+                break
 
-            clan_members_in_raid = [c for c in raid.data['Response']['entries'] if c['characterId'] in clan_characters]
+            activity_names = self.get_activity_names(set(raid.activity_hash for raid in raids))
+            new_raids = []
+            for raid in raids:
+                new_raids.append({
+                    'parent_char': raid.parent_character,
+                    'pgcr_id': raid.pgcr_id,
+                    'activity': activity_names.get(raid.activity_hash),
+                    'activity_hash': raid.activity_hash,
+                    'completed': str(raid.completed),
+                    'duration': raid.duration
+                })
 
-            for clan_member in clan_members_in_raid:
-                character = self.db.session.query(models.Characters).filter(models.Characters.char_id==clan_member['characterId']).first()
-                stats_exists = self.db.session.query(models.RaidStats).filter(models.RaidStats.pgcr_id==raid.pgcr_id).filter(models.RaidStats.parent_char==character.id).first()
-                if stats_exists:
-                    continue
+            statement = insert(models.RaidStats.__table__).values(new_raids).on_conflict_do_nothing(index_elements=['pgcr_id', 'parent_char'])
+            inserted = self.db.session.execute(statement).rowcount
+            last_id = raids[-1].id
+            watermark.last_id = max(watermark.last_id, last_id)
+            watermark.updated = datetime.now()
 
-                completion = int(clan_member['values']['completed']['basic']['value'])
+            try:
+                self.db.session.commit()
+                added = added + inserted
+            except Exception as e:
+                logger.warning(f'Failed to commit db transaction. {e}')
+                self.db.session.rollback()
+                break
 
-                if completion < 1:
-                    continue
+        print(f'Done. Processed {added} raids. Time to run: ', datetime.now() - start_time)
 
-                new_raid = models.RaidStats(
-                    parent_char=character.id,
-                    pgcr_id=raid.data['Response']['activityDetails']['instanceId'],
-                    activity=activity_name,
-                    activity_hash=activity_hash,
-                    completed=completion,
-                    duration=int(clan_member['values']['activityDurationSeconds']['basic']['value'])
-                )
+    def get_activity_names(self, activity_hashes):
+        """Returns {activity_hash: name} for the activities found in the Manifest."""
+        names = {}
+        for activity_hash in activity_hashes:
+            try:
+                names[activity_hash] = self.get_definition('DestinyActivityDefinition', activity_hash)['displayProperties']['name']
+            except Exception:
+                logger.warning(f'Failed to get activity name for {activity_hash}')
+        return names
 
-                self.db.session.add(new_raid)
+    def update_raid_names(self):
+        """Name the RaidStats rows that were stored before their activity was in the Manifest."""
+        activity_hashes = [row.activity_hash for row in self.db.session.query(models.RaidStats.activity_hash).filter(models.RaidStats.activity==None).distinct()]
+        if not activity_hashes:
+            return
 
-                try:
-                    self.db.session.commit()
-                    now = datetime.now()
-                except Exception as e:
-                    logger.warning(f'Failed to commit db transaction. {e}')
-                    self.db.session.rollback()
+        for activity_hash, name in self.get_activity_names(activity_hashes).items():
+            self.db.session.query(models.RaidStats) \
+                .filter(models.RaidStats.activity_hash==activity_hash, models.RaidStats.activity==None) \
+                .update({'activity': name}, synchronize_session=False)
 
-        print('Done. Time to run: ', datetime.now() - start_time)
+        try:
+            self.db.session.commit()
+        except Exception as e:
+            logger.warning(f'Failed to commit db transaction. {e}')
+            self.db.session.rollback()
 
     def get_raid_total(self):
         query = self.db.session.query(models.RaidStats.activity.label('raid'), func.count(models.RaidStats.id).label('total')).group_by(models.RaidStats.activity).order_by(func.count(models.RaidStats.id).desc()).all()
@@ -694,7 +737,7 @@ class DestinyAPI(object):
         print(f'\nTotal raids: {total_count}')
 
     def get_forge_stats(self):
-        query = self.db.session.query(models.Players.name.label('name'), func.count(models.PostGameCarnageReport.id).label('total')).join(models.Characters, models.Players.id==Characters.parent_id).filter(models.PostGameCarnageReport.parent_character==Characters.id).group_by(models.Players.name).order_by(func.count(models.PostGameCarnageReport.id).desc()).all()
+        query = self.db.session.query(models.Players.name.label('name'), func.count(models.PgcrParticipant.id).label('total')).join(models.Characters, models.Players.id==models.Characters.parent_id).filter(models.PgcrParticipant.parent_character==models.Characters.id).group_by(models.Players.name).order_by(func.count(models.PgcrParticipant.id).desc()).all()
 
         for result in query:
             print(f'{result.name}: {result.total}')
@@ -710,7 +753,7 @@ class DestinyAPI(object):
         return query
 
     def get_definition_inventory_item(self, item_hash):
-        item = self.db.session.query(models.DestinyInventoryItemDefinition).filter(models.DestinyInventoryItemDefinition.hash==item_hash).first()
+        item = self.get_definition('DestinyInventoryItemDefinition', item_hash, convert_hash=False)
         if item:
             return item
         else:
@@ -767,6 +810,8 @@ class DestinyAPI(object):
         self.get_characters_power(membership_id, profile)
         self.db_update_player_last_played(membership_id, membership_type)
         self.update_player_last_updated(membership_id)
+        # roster and players are served from the roster snapshot, they are invalidated when it is rebuilt
+        cache.invalidate_later('info', 'collectibles')
 
     def get_player_active_title(self, membership_id, profile):
         characters = profile['Response']['characters']['data']
@@ -887,29 +932,76 @@ class DestinyAPI(object):
             return
 
     def db_store_pgcr(self, player, character_id, match, mode):
-        character = self.db.session.query(models.Characters).filter(models.Characters.char_id==character_id).first()
-        pgcr = self.get_pgcr(match)
-        if not pgcr:
-            logger.warning(f'{match}: Failed to retrieve PGCR')
-            return
+        """
+        Store a PGCR for a character. PGCRs are shared by every clan member in the match, so the PGCR is only
+        downloaded if it is not stored yet and no other consumer is already downloading it.
+        """
+        deadline = time() + Config.PGCR_INFLIGHT_WAIT
+        while not pgcr_store.get_stored([match]):
+            if pgcr_store.claim(match):
+                try:
+                    return self.db_add_pgcr(player, character_id, match, mode, self.get_pgcr(match))
+                finally:
+                    pgcr_store.release(match)
 
-        entry = models.PostGameCarnageReport(
-            pgcr_id=pgcr['Response']['activityDetails']['instanceId'],
-            data=pgcr,
-            mode=mode,
-            modes=pgcr['Response']['activityDetails']['modes'],
-            date=pgcr['Response']['period'],
-            parent_character=character.id
-        )
+            if time() > deadline:
+                logger.warning(f'{player}:{character_id}:{mode}:{match} Timed out waiting for another consumer to store the PGCR. Fetching it.')
+                return self.db_add_pgcr(player, character_id, match, mode, self.get_pgcr(match))
+            sleep(0.5)
+
+        return self.db_add_pgcr(player, character_id, match, mode)
 
-        self.db.session.add(entry)
+    def db_add_pgcr(self, player, character_id, match, mode, pgcr=None):
+        """Store an already retrieved PGCR for a character. Without a PGCR, the character is linked to the stored copy."""
+        return self.db_add_pgcrs([{'player': player, 'character_id': character_id, 'match': match, 'mode': mode, 'pgcr': pgcr}], fallback=False) == 1
+
+    def db_add_pgcrs(self, reports, fallback=True):
+        """
+        Store many PGCRs and link them to their characters in one transaction.
+        reports is a list of dicts with player, character_id, match, mode and pgcr keys. pgcr may be None for
+        matches that are already stored.
+        If the transaction fails, every PGCR is stored on its own so that one bad row does not lose the whole batch.
+        Returns the number of characters linked to a PGCR.
+        """
+        if not reports:
+            return 0
+
+        character_ids = set(str(report['character_id']) for report in reports)
+        characters = dict(self.db.session.query(models.Characters.char_id, models.Characters.id).filter(models.Characters.char_id.in_(character_ids)))
 
         try:
+            stored = pgcr_store.store_reports([report['pgcr'] for report in reports if isinstance(report['pgcr'], dict)])
+            stored.update(pgcr_store.get_stored(report['match'] for report in reports if str(report['match']) not in stored))
+
+            participants = []
+            for report in reports:
+                parent_character = characters.get(str(report['character_id']))
+                if parent_character is None:
+                    logger.warning(f'{report["player"]}:{report["character_id"]}:{report["mode"]}:{report["match"]} Character not found. Skipping PGCR.')
+                    continue
+                if str(report['match']) not in stored:
+                    logger.warning(f'{report["match"]}: Failed to retrieve PGCR')
+                    continue
+
+                pgcr_id, date = stored[str(report['match'])]
+                participants.append({'pgcr': pgcr_id, 'parent_character': parent_character, 'mode': report['mode'], 'date': date})
+
+            pgcr_store.add_participants(participants)
             self.db.session.commit()
-            logger.info(f'{player}:{character_id}:{mode}:{match} PGCR successfully added to the database')
+            logger.info(f'{len(participants)} PGCRs successfully added to the database')
+            return len(participants)
         except Exception as e:
-            logger.warning(e)
             self.db.session.rollback()
+            if not fallback or len(reports) == 1:
+                logger.warning(e)
+                return 0
+            logger.warning(f'Failed to add {len(reports)} PGCRs in one transaction. Adding them one at a time. Reason: {e}')
+
+        stored = 0
+        for report in reports:
+            if self.db_add_pgcr(report['player'], report['character_id'], report['match'], report['mode'], report['pgcr']):
+                stored = stored + 1
+        return stored
 
     def db_update_match(self, char, match_id):
         match = self.get_pgcr(match_id)
@@ -926,6 +1018,7 @@ class DestinyAPI(object):
         char = str(char)
         _character = self.db.session.query(models.Characters).filter(models.Characters.char_id==char).first()
         player = self.db.session.query(models.Players).join(models.Characters).filter(models.Characters.char_id==char).first()
+        daily_kills = {}
 
         for entry in _entries:
             # break this characterId if check so that it returns, remove it from the for loop
@@ -948,44 +1041,53 @@ class DestinyAPI(object):
                     weapon_id = self.get_hash(weap_ref_id)
 
                     try:
-                        _item = self.get_definition('DestinyInventoryItemDefinition', weapon_id, convert_hash=False)
+                        weapon_info = self.get_weapon_info(weapon_id)
                     except Exception as e:
                         print(f'Error processing {weapon_id}. Perhaps the Destiny DB needs an update? Skipping weapon.')
                         print(e)
                         continue
 
-                    name = _item['displayProperties']['name']
-                    item_bucket_hash = _item['inventory']['bucketTypeHash']
-                    weapon_type = self.get_weapon_type(item_bucket_hash)
-                    
-                    if name != 'Classified':
-                        subtype = _item['itemTypeDisplayName']
-                    else:
-                        subtype = 'Classified'
+                    name = weapon_info.name
+                    weapon_type = weapon_info.weapon_type
+                    subtype = weapon_info.subtype
 
-                    all_weapons = [weap.name for weap in self.db.session.query(models.Weapons).all()]
-                    if name not in all_weapons:
-                        # Add the weapon to our database if it does not exist
-                        new = models.Weapons(name=name, damage_type=weapon_type, weapon_id=weapon_id, gun_type=subtype)
-                        self.db.session.add(new)
-                        self.db.session.commit()
-
-                    _weap = self.db.session.query(models.Weapons).filter(models.Weapons.name==name).first()
-                    new_weapon_entry = models.WeaponsData(kills=kills, match_time=matchtime, parent_id=_character.id, parent_weapon=_weap.id)
+                    # Adds the weapon to our database if it does not exist
+                    _weap_id = weapon_registry.registry.get_id(weapon_id, name, damage_type=weapon_type, gun_type=subtype)
+                    new_weapon_entry = models.WeaponsData(kills=kills, match_time=matchtime, parent_id=_character.id, parent_weapon=_weap_id)
                     self.db.session.add(new_weapon_entry)
 
+                    key = (matchtime.date(), _character.id, _weap_id)
+                    daily_kills[key] = daily_kills.get(key, 0) + kills
+
                     # TODO: maybe helper functions?
                     #   * add_weapon(<add a new weapons stats>)
                     #   * update_weapon(insert new weapond data)
 
         #print(f'{match_id}: match successfully processed')
         _character.last_pvp_match = str(match_id)
+        self.db_add_weapon_kills_daily(daily_kills)
 
         # TODO: only update if there is new data - What was this referring to?
         try:
             self.db.session.commit()
+            cache.invalidate_later('players', 'weapons')
         except Exception as e:
             self.db.session.rollback()
+            # Weapons inserted in this transaction were rolled back too
+            weapon_registry.registry.clear()
+
+    def db_add_weapon_kills_daily(self, daily_kills):
+        """Add kills to the weapon_kills_daily rollup in the current transaction. daily_kills maps (day, character, weapon) to kills."""
+        if not daily_kills:
+            return
+
+        values = [{'day': day, 'parent_id': parent_id, 'parent_weapon': parent_weapon, 'kills': kills} for (day, parent_id, parent_weapon), kills in daily_kills.items()]
+        statement = insert(models.WeaponKillsDaily.__table__).values(values)
+        statement = statement.on_conflict_do_update(
+            index_elements=['day', 'parent_id', 'parent_weapon'],
+            set_={'kills': models.WeaponKillsDaily.__table__.c.kills + statement.excluded.kills}
+        )
+        self.db.session.execute(statement)
 
     # Section: CLASSIFIED WEAPON HANDLING
     def classified_weapon_check(self):
@@ -999,6 +1101,7 @@ class DestinyAPI(object):
                 subtype = query['itemTypeDisplayName']
                 weapon.gun_type = subtype
                 self.db.session.commit()
+                weapon_registry.registry.clear()
 
     # Section: COLLECTIONS
 
@@ -1137,6 +1240,7 @@ class DestinyAPI(object):
                     new_collectible = models.CollectiblesGame(collectible_hash=collectible_hash, name=collectible_name, item_hash=collectible_item_hash, presentation_node_type=str(PRESENTATION_NODE_TYPE_WEAPONS), parent_presentation_node_hash=str(node_hash), icon_url=collectible_icon_url, expansion_id=expansion)
                     self.db.session.add(new_collectible)
                     self.db.session.commit()
+                    cache.invalidate_later('collectibles')
 
     def get_profile_weapons(self, membership_id, data):
         """
@@ -1466,6 +1570,26 @@ class DestinyAPI(object):
 
         return all_weapons_list
 
+    def get_weapon_info(self, weapon_id):
+        """
+        Returns the name, weapon type, subtype and tier of a weapon.
+        Uses the precomputed weapon index, falling back to the definitions for weapons that are not in it.
+        """
+        index = weapon_index.get_index()
+        weapon = index.get(weapon_id) if index else None
+        if weapon:
+            return weapon
+
+        _item = self.get_definition('DestinyInventoryItemDefinition', weapon_id, convert_hash=False)
+        name = _item['displayProperties']['name']
+        subtype = _item['itemTypeDisplayName'] if name != 'Classified' else 'Classified'
+        return weapon_index.WeaponInfo(
+            name=name,
+            weapon_type=self.get_weapon_type(_item['inventory']['bucketTypeHash']),
+            subtype=subtype,
+            tier=_item['inventory'].get('tierTypeName')
+        )
+
     def get_weapon_type(self, _hash):
         weapon_type = self.get_definition('DestinyInventoryBucketDefinition', _hash)
         weapon_type_name = weapon_type['displayProperties']['name']
@@ -1572,30 +1696,20 @@ class DestinyAPI(object):
 
     def api_get_player_weapons(self, membership_id, days):
         """Returns all weapon kill counts for a Player."""
-        if days == 0:
-            weapons = self.db.session.query(models.Weapons.name, models.Weapons.weapon_id, func.sum(models.WeaponsData.kills).label('total_kills')) \
-                .join(models.WeaponsData) \
-                .join(models.Characters) \
-                .join(models.Players) \
-                .group_by(models.Weapons.name, models.Weapons.weapon_id) \
-                .filter(models.Players.membership_id==membership_id) \
-                .order_by(func.sum(models.WeaponsData.kills).desc()) \
-                .all()
-            results = self.player_weapon_schema.dump(weapons)
-            return jsonify(results.data)
-        elif days > 0:
-            time_range = datetime.now() - timedelta(days=days)
-            weapons = self.db.session.query(models.Weapons.name, models.Weapons.weapon_id, func.sum(models.WeaponsData.kills).label('total_kills')) \
-                .join(models.WeaponsData) \
-                .join(models.Characters) \
-                .join(models.Players) \
-                .group_by(models.Weapons.name, models.Weapons.weapon_id) \
-                .filter(models.Players.membership_id==membership_id) \
-                .filter(models.WeaponsData.match_time >= time_range) \
-                .order_by(func.sum(models.WeaponsData.kills).desc()) \
-                .all()
-            results = self.player_weapon_schema.dump(weapons)
-            return jsonify(results.data)
+        total_kills = func.sum(models.WeaponKillsDaily.kills).label('total_kills')
+        weapons = self.db.session.query(models.Weapons.name, models.Weapons.weapon_id, total_kills) \
+            .join(models.WeaponKillsDaily) \
+            .join(models.Characters) \
+            .join(models.Players) \
+            .group_by(models.Weapons.name, models.Weapons.weapon_id) \
+            .filter(models.Players.membership_id==membership_id) \
+            .order_by(total_kills.desc())
+
+        if days > 0:
+            weapons = weapons.filter(models.WeaponKillsDaily.day >= self.get_rollup_start(days))
+
+        results = self.player_weapon_schema.dump(weapons.all())
+        return jsonify(results.data)
 
     def get_player_weapons_days(self, membership_id, days):
         if days == 0:
@@ -1659,23 +1773,16 @@ class DestinyAPI(object):
         return results
 
     def api_get_all_weapons(self, days):
-        if days == 0:
-            results = self.db.session.query(models.Weapons.name, func.sum(models.WeaponsData.kills).label("total_kills"), models.Weapons.weapon_id) \
-                .join(models.WeaponsData) \
-                .group_by(models.Weapons.name, models.Weapons.weapon_id) \
-                .order_by(func.sum(models.WeaponsData.kills).desc()) \
-                .all()
-            results = self.weapon_type_kills_schema.dump(results)
-            return jsonify(results.data)
-
-        timerange = datetime.now() - timedelta(days=days)
-        results = self.db.session.query(models.Weapons.name, func.sum(models.WeaponsData.kills).label("total_kills"), models.Weapons.weapon_id) \
-            .join(models.WeaponsData) \
+        total_kills = func.sum(models.WeaponKillsDaily.kills).label('total_kills')
+        results = self.db.session.query(models.Weapons.name, total_kills, models.Weapons.weapon_id) \
+            .join(models.WeaponKillsDaily) \
             .group_by(models.Weapons.name, models.Weapons.weapon_id) \
-            .filter(models.WeaponsData.match_time >= timerange) \
-            .order_by(func.sum(models.WeaponsData.kills).desc()) \
-            .all()
-        results = self.weapon_type_kills_schema.dump(results)
+            .order_by(total_kills.desc())
+
+        if days > 0:
+            results = results.filter(models.WeaponKillsDaily.day >= self.get_rollup_start(days))
+
+        results = self.weapon_type_kills_schema.dump(results.all())
         return jsonify(results.data)
 
     def api_get_top_weapon_by_type(self, weapon_type, days):
@@ -1683,25 +1790,17 @@ class DestinyAPI(object):
             print('Invalid weapon type. Valid weapon types: kinetic, energy, power')
             return
 
-        if days == 0:
-            results = self.db.session.query(models.Weapons.name, func.sum(models.WeaponsData.kills).label("total_kills"), models.Weapons.weapon_id) \
-                .join(models.WeaponsData) \
-                .group_by(models.Weapons.name, models.Weapons.weapon_id) \
-                .filter(models.Weapons.damage_type==weapon_type) \
-                .order_by(func.sum(models.WeaponsData.kills).desc()) \
-                .all()
-            results = self.weapon_type_kills_schema.dump(results)
-            return jsonify(results.data)
-
-        timerange = datetime.now() - timedelta(days=days)
-        results = self.db.session.query(models.Weapons.name, func.sum(models.WeaponsData.kills).label("total_kills"), models.Weapons.weapon_id) \
-            .join(models.WeaponsData) \
+        total_kills = func.sum(models.WeaponKillsDaily.kills).label('total_kills')
+        results = self.db.session.query(models.Weapons.name, total_kills, models.Weapons.weapon_id) \
+            .join(models.WeaponKillsDaily) \
             .group_by(models.Weapons.name, models.Weapons.weapon_id) \
             .filter(models.Weapons.damage_type==weapon_type) \
-            .filter(models.WeaponsData.match_time >= timerange) \
-            .order_by(func.sum(models.WeaponsData.kills).desc()) \
-            .all()
-        results = self.weapon_type_kills_schema.dump(results)
+            .order_by(total_kills.desc())
+
+        if days > 0:
+            results = results.filter(models.WeaponKillsDaily.day >= self.get_rollup_start(days))
+
+        results = self.weapon_type_kills_schema.dump(results.all())
         return jsonify(results.data)
 
     def get_weapon_name(self, weapon_id):
@@ -1728,29 +1827,19 @@ class DestinyAPI(object):
         if not weapon:
             return
 
-        total_kills = func.sum(models.WeaponsData.kills).label('total_kills')
-        if days == 0:
-            weapon_stats = self.db.session.query(models.Players.name, models.Players.membership_id, total_kills) \
-                .select_from(models.Characters) \
-                .join(models.WeaponsData, models.Players) \
-                .group_by(models.Players.name, models.Players.membership_id) \
-                .filter(models.Weapons.weapon_id==weapon_id) \
-                .order_by(total_kills.desc()) \
-                .all()
-            results = self.weapon_kills_schema.dump(weapon_stats)
-            return jsonify(results.data)
-
-        time_range = datetime.now() - timedelta(days=days)
+        total_kills = func.sum(models.WeaponKillsDaily.kills).label('total_kills')
         weapon_stats = self.db.session.query(models.Players.name, models.Players.membership_id, total_kills) \
-            .select_from(models.Characters) \
-            .join(models.WeaponsData, models.Players) \
+            .join(models.Characters) \
+            .join(models.WeaponKillsDaily) \
+            .join(models.Weapons) \
             .group_by(models.Players.name, models.Players.membership_id) \
             .filter(models.Weapons.weapon_id==weapon_id) \
-            .filter(models.WeaponsData.match_time >= time_range) \
-            .order_by(total_kills.desc()) \
-            .all()
+            .order_by(total_kills.desc())
 
-        results = self.weapon_kills_schema.dump(weapon_stats)
+        if days > 0:
+            weapon_stats = weapon_stats.filter(models.WeaponKillsDaily.day >= self.get_rollup_start(days))
+
+        results = self.weapon_kills_schema.dump(weapon_stats.all())
         return jsonify(results.data)
 
     def get_weapon_kills_days(self, weapon_id, days):
@@ -1786,6 +1875,7 @@ class DestinyAPI(object):
         Effectively wipes out all match related data for all characters. Resets each characters' last match played value, and wipes out all entries in models.WeaponsData.
         """
         self.db.session.query(models.WeaponsData).delete()
+        self.db.session.query(models.WeaponKillsDaily).delete()
         all_chars = self.db.session.query(models.Characters).all()
         for char in all_chars:
             char.last_pvp_match = 0
@@ -1793,12 +1883,17 @@ class DestinyAPI(object):
         try:
             self.db.session.commit()
             print('Set all characters last_pvp_match to 0')
-            print('Deleted all entires in models.WeaponsData')
+            print('Deleted all entires in models.WeaponsData and models.WeaponKillsDaily')
         except Exception as e:
             self.db.session.rollback()
 
     def get_character_last_activity_by_mode(self, membership_id, character, mode):
-        latest_pgcr = self.db.session.query(models.PostGameCarnageReport).join(models.Characters).filter(models.Characters.char_id==character.char_id).filter(models.PostGameCarnageReport.mode==mode).order_by(models.PostGameCarnageReport.date.desc()).first()
+        latest_pgcr = self.db.session.query(models.PostGameCarnageReport.pgcr_id) \
+            .join(models.PgcrParticipant) \
+            .filter(models.PgcrParticipant.parent_character==character.id) \
+            .filter(models.PgcrParticipant.mode==mode) \
+            .order_by(models.PgcrParticipant.date.desc()) \
+            .first()
         latest_activity_id = latest_pgcr.pgcr_id if latest_pgcr else '0'
         logger.debug(f'{membership_id}:{character.char_id}:{mode} Latest activity id: {latest_activity_id}')
         return latest_activity_id
@@ -1844,6 +1939,104 @@ class DestinyAPI(object):
 
         return redis_data
 
+    # Section: ASYNC
+    async def get_pgcr_async(self, client, match_id):
+        return await client.http_get(f'https://stats.bungie.net/Platform/Destiny2/Stats/PostGameCarnageReport/{match_id}')
+
+    async def get_activity_history_by_mode_async(self, client, player, membership_type, char, mode, latest_pgcr):
+        """
+        Async version of get_activity_history_by_mode().
+        Pages are still fetched in order because each page decides whether the next one is needed.
+        """
+        all_activities = []
+        page = 0
+
+        while True:
+            logger.debug(f'{player}:{membership_type}:{char}:{mode} Fetching page {page}')
+            activities = await client.http_get(f'https://bungie.net/Platform/Destiny2/{membership_type}/Account/{player}/Character/{char}/Stats/Activities/?mode={mode}&page={page}&count=250')
+            if not activities:
+                logger.warning(f'{player}:{membership_type}:{char}:{mode} Bad request. Activities returned null.')
+                return
+
+            # If 1665 is returned, the profile is private and no further processing is necessary
+            if activities == 1665:
+                return
+
+            # Empty Response key means the request is successful, but no activities were played
+            if not activities['Response'] or 'activities' not in activities['Response']:
+                break
+
+            pgcrs = [activity['activityDetails']['instanceId'] for activity in activities['Response']['activities'] if int(activity['activityDetails']['instanceId']) > int(latest_pgcr)]
+            all_activities.extend(pgcrs)
+            if len(pgcrs) < 250:
+                break
+
+            page = page + 1
+
+        if not all_activities:
+            return
+
+        # Activities should be in ascending order so they are processed oldest to newest
+        return sorted(all_activities, key=lambda x: int(x))
+
+    async def get_new_matches_async(self, client, membership_id, membership_type, mode):
+        """
+        Async version of get_new_matches(). The activity history of every character is fetched concurrently.
+        Returns the same dictionary as get_new_matches().
+        """
+        clan_member = self.db.session.query(models.Players).filter(models.Players.membership_id==membership_id).first()
+        if not clan_member:
+            logger.debug(f'{membership_id}: Player not found in database')
+            return
+
+        redis_data = {
+            'membershipId': clan_member.membership_id,
+            'membershipType': clan_member.membership_type,
+            'characters': [],
+            'mode': mode
+        }
+
+        characters = self.db_get_characters(clan_member.membership_id)
+        if not characters:
+            return
+
+        # Database lookups stay sequential; only the API requests run concurrently
+        latest_matches = [self.get_character_last_activity_by_mode(membership_id, character, mode) for character in characters]
+        requests = [self.get_activity_history_by_mode_async(client, membership_id, membership_type, character.char_id, mode, latest_match) for character, latest_match in zip(characters, latest_matches)]
+        results = await asyncio.gather(*requests, return_exceptions=True)
+
+        for character, matches in zip(characters, results):
+            if isinstance(matches, Exception):
+                logger.warning(f'{membership_id}:{membership_type}:{character.char_id}:{mode} Failed to get new matches. Reason: {matches}')
+                continue
+
+            if not matches:
+                continue
+
+            redis_data['characters'].append({'characterId': character.char_id, 'mode': mode, 'matches': matches})
+            logger.debug(f'{membership_id}:{membership_type}:{character.char_id}:{mode} Sending data to consumer: {redis_data}')
+
+        return redis_data
+
+    async def db_store_pgcr_async(self, client, player, character_id, match, mode):
+        """Async version of db_store_pgcr()."""
+        deadline = time() + Config.PGCR_INFLIGHT_WAIT
+        while not pgcr_store.get_stored([match]):
+            if pgcr_store.claim(match):
+                try:
+                    pgcr = await self.get_pgcr_async(client, match)
+                    return self.db_add_pgcr(player, character_id, match, mode, pgcr)
+                finally:
+                    pgcr_store.release(match)
+
+            if time() > deadline:
+                logger.warning(f'{player}:{character_id}:{mode}:{match} Timed out waiting for another consumer to store the PGCR. Fetching it.')
+                pgcr = await self.get_pgcr_async(client, match)
+                return self.db_add_pgcr(player, character_id, match, mode, pgcr)
+            await asyncio.sleep(0.5)
+
+        return self.db_add_pgcr(player, character_id, match, mode)
+
 class DestinyWeaponOwners(object):
     """This is mainly for serializing a Destiny Weapon object. I needed a way to return a list of players that own a particular weapon to the front-end via the API."""
     def __init__(self, weapon, owners):
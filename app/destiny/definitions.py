@@ -0,0 +1,241 @@
+from collections import OrderedDict, namedtuple
+from time import time
+import json
+import os
+import sqlite3
+import redis
+from app import models
+from app.utils import log
+from config import Config
+
+logger = log.get_logger(__name__)
+
+MANIFEST_CHANNEL = 'manifest:updates'
+MANIFEST_KEY = 'manifest:current'
+
+class DefinitionCache(object):
+    """
+    Bounded LRU cache of manifest definitions keyed by (table, hash).
+    Definitions only change with the manifest, so the cache is dropped whenever the process switches to a new manifest.
+    """
+    def __init__(self, maxsize, check_interval):
+        self.maxsize = maxsize
+        self.check_interval = check_interval
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.manifest_url = None
+        self.pending_url = None
+        self.last_check = 0
+
+    def get(self, table, definition_hash):
+        """Returns the cached definition, or None if it is not cached."""
+        self.check_manifest()
+        key = (table, definition_hash)
+        if key in self.data:
+            self.data.move_to_end(key)
+            self.hits = self.hits + 1
+            return self.data[key]
+
+        self.misses = self.misses + 1
+        return
+
+    def set(self, table, definition_hash, definition):
+        key = (table, definition_hash)
+        self.data[key] = definition
+        self.data.move_to_end(key)
+        if len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def clear(self, manifest_url=None):
+        self.data.clear()
+        self.manifest_url = manifest_url
+        self.last_check = time()
+
+    def check_manifest(self):
+        """
+        Switch to a new manifest if one has been announced on MANIFEST_CHANNEL, or, as a fallback when Redis
+        is unavailable, if the Manifest url in the database has changed since the cache was filled.
+        """
+        if self.pending_url:
+            manifest_url, self.pending_url = self.pending_url, None
+            if manifest_url != self.manifest_url:
+                switch_version(manifest_url)
+            return
+
+        now = time()
+        if now - self.last_check < self.check_interval:
+            return
+
+        self.last_check = now
+        try:
+            manifest = models.db.session.query(models.Manifest.url).first()
+        except Exception as e:
+            logger.warning(f'Failed to check the current Manifest url. Reason: {e}')
+            return
+
+        manifest_url = manifest.url if manifest else None
+        if manifest_url != self.manifest_url:
+            switch_version(manifest_url)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self.data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0
+        }
+
+# Rows returned by get_all(), matching the hash/json attributes of the Destiny*Definition models
+Definition = namedtuple('Definition', ['hash', 'json'])
+
+class PostgresDefinitionStore(object):
+    """Definitions copied into the Destiny*Definition tables by manifest.update_database()."""
+    def get(self, table, definition_hash):
+        model = getattr(models, table, None)
+        if not model:
+            logger.warning(f'{table} not found in models; cannot look up hash.')
+            return
+
+        row = models.db.session.query(model.json).filter(model.hash==str(definition_hash)).first()
+        return row.json if row else None
+
+    def get_all(self, table):
+        model = getattr(models, table, None)
+        if not model:
+            logger.warning(f'{table} not found in models; cannot look up hash.')
+            return []
+
+        return models.db.session.query(model).all()
+
+class SqliteDefinitionStore(object):
+    """
+    Definitions read straight from a downloaded content database snapshot (see manifest.download_database()).
+    One read-only connection is kept open for the life of the store. sqlite3 caches the prepared statement
+    for each table's query, and mmap_size lets SQLite map the file instead of copying pages into its own cache.
+    """
+    def __init__(self, path, mmap_size=0):
+        self.path = path
+        self.mmap_size = mmap_size
+        self.connection = None
+        self.tables = set()
+        self.key_columns = {}
+
+    def connect(self):
+        if not os.path.isfile(self.path):
+            logger.warning(f'Content database {self.path} not found; run the manifest job to download it.')
+            return
+
+        connection = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True, check_same_thread=False, cached_statements=256)
+        if self.mmap_size:
+            connection.execute(f'PRAGMA mmap_size={int(self.mmap_size)}')
+
+        self.tables = set(row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'"))
+        # Most tables are keyed by id, but a few (e.g. DestinyHistoricalStatsDefinition) by a string key column
+        self.key_columns = {table: connection.execute(f'PRAGMA table_info({table})').fetchone()[1] for table in self.tables}
+        self.connection = connection
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def execute(self, table, query, args=()):
+        if not self.connection:
+            self.connect()
+            if not self.connection:
+                return []
+
+        if table not in self.tables:
+            logger.warning(f'{table} not found in {self.path}; cannot look up hash.')
+            return []
+
+        return self.connection.execute(query, args).fetchall()
+
+    def get_key_column(self, table):
+        if not self.connection:
+            self.connect()
+        return self.key_columns.get(table, 'id')
+
+    def get(self, table, definition_hash):
+        # The id column holds the signed version of the hash, see DestinyAPI.get_hash()
+        key_column = self.get_key_column(table)
+        key = int(definition_hash) if key_column == 'id' else str(definition_hash)
+        rows = self.execute(table, f'SELECT json FROM {table} WHERE {key_column} = ?', (key,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def get_all(self, table):
+        # Columns by position, since the key column is not called id in every table
+        rows = self.execute(table, f'SELECT * FROM {table}')
+        return [Definition(hash=str(row[0]), json=json.loads(row[1])) for row in rows]
+
+_store = None
+
+def get_store():
+    """Return the definition store selected by DEFINITION_STORE ('postgres' or 'sqlite')."""
+    global _store
+    if _store is None:
+        if Config.DEFINITION_STORE == 'sqlite':
+            # MANIFEST_DB_PATH points at the most recently activated snapshot
+            _store = SqliteDefinitionStore(Config.MANIFEST_DB_PATH, Config.SQLITE_MMAP_SIZE)
+        else:
+            _store = PostgresDefinitionStore()
+    return _store
+
+def switch_version(manifest_url):
+    """
+    Start serving definitions from another manifest version and drop every cached definition.
+    With the sqlite store, the new snapshot is opened side by side with the old one, which is closed once the
+    new store is in place, so lookups never see a mix of two versions.
+    """
+    global _store
+    logger.info(f'Switching to Manifest {manifest_url}. Clearing {len(cache.data)} cached definitions.')
+    if Config.DEFINITION_STORE == 'sqlite' and manifest_url:
+        from app.destiny import manifest
+        path = manifest.ensure_snapshot(manifest_url)
+        old_store, _store = _store, SqliteDefinitionStore(path, Config.SQLITE_MMAP_SIZE)
+        if old_store:
+            old_store.close()
+
+    cache.clear(manifest_url)
+
+def publish_version(manifest_url):
+    """Switch this process to a new manifest and tell every other worker and API process to do the same."""
+    switch_version(manifest_url)
+    try:
+        connection = redis.Redis(host=Config.redis, port=6379, db=0)
+        connection.set(MANIFEST_KEY, manifest_url)
+        connection.publish(MANIFEST_CHANNEL, manifest_url)
+    except redis.RedisError as e:
+        logger.warning(f'Failed to publish Manifest {manifest_url}. Other processes will pick it up from the database. Reason: {e}')
+
+def on_manifest_published(message):
+    """Runs in the subscriber thread; the switch itself happens on the next lookup in the main thread."""
+    manifest_url = message['data'].decode('utf-8')
+    logger.info(f'New Manifest published: {manifest_url}')
+    if Config.DEFINITION_STORE == 'sqlite':
+        # Download the snapshot here so that the main thread does not have to wait for it
+        from app.destiny import manifest
+        try:
+            manifest.ensure_snapshot(manifest_url)
+        except Exception as e:
+            # An exception would end the subscriber thread. The periodic database check switches over instead.
+            logger.warning(f'Failed to download the snapshot for Manifest {manifest_url}. Reason: {e}')
+            return
+
+    cache.pending_url = manifest_url
+
+def subscribe():
+    """Listen for new manifests in a background thread. Returns the thread, or None if Redis is unavailable."""
+    try:
+        connection = redis.Redis(host=Config.redis, port=6379, db=0)
+        pubsub = connection.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{MANIFEST_CHANNEL: on_manifest_published})
+        return pubsub.run_in_thread(sleep_time=1, daemon=True)
+    except redis.RedisError as e:
+        logger.warning(f'Failed to subscribe to {MANIFEST_CHANNEL}. Falling back to checking the database. Reason: {e}')
+        return
+
+cache = DefinitionCache(Config.DEFINITION_CACHE_SIZE, Config.DEFINITION_CACHE_CHECK_INTERVAL)
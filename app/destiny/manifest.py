@@ -1,18 +1,23 @@
 from datetime import datetime
+from time import time
 import json
 import os
 import shutil
 import sqlite3
-import requests
+import tempfile
 import zipfile
 from app import utilities
 from app import models
 from app import create_app
+from app.destiny import definitions
+from app.destiny import weapon_index
 from app.utils import log
 from config import Config
 
 logger = log.get_logger(__name__)
 
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 def get_manifest():
     """
     Returns the current Destiny 2 API Manifest.
@@ -30,33 +35,25 @@ def get_manifest_url():
     new_db_url = f'https://bungie.net{manifest_db_name}'
     return new_db_url
 
-def update_check():
-    """
-    Checks the current manifest database URL from the API against the manifest database URL that we last downloaded.
-    Returns false if the URL has not changed. Returns true if it has changed.
-    """
+def update(force=False):
+    """Check if there is a new Manifest. If there is a new Manifest, load it and update the database with the latest Manifest url."""
     new_manifest = get_manifest_url()
-    current_manifest = models.db.session.query(models.Manifest).first().url
-
-    if current_manifest == new_manifest:
-        print('No update found for the Manifest.')
-        return False
-    else:
-        print('New Manifest available.')
-        return True
+    current_manifest = models.db.session.query(models.Manifest).first()
 
-def update(force=False):
-    """Check if there is a new Manifest. If there is a new Manifest, update the database with the latest Manifest url."""
     if not force:
-        manifest_check = update_check()
-        if not manifest_check:
+        if current_manifest.url == new_manifest:
             print('No update found for the Manifest.')
             return
+        print('New Manifest available.')
     else:
         print('Forcing Manifest update.')
-    
-    new_manifest = get_manifest_url()
-    current_manifest = models.db.session.query(models.Manifest).first()
+
+    # The url is recorded last so that a failed download is retried on the next run
+    download_database(new_manifest, force=force)
+    activate_snapshot(new_manifest)
+    update_database()
+    build_weapon_index(new_manifest)
+
     current_manifest.url = new_manifest
     current_manifest.updated = datetime.now()
 
@@ -68,48 +65,108 @@ def update(force=False):
         print(f'Manifest URL was not updated in the database. Reason: {e}')
         return
 
-    download_database()
-    update_database()
+    definitions.publish_version(new_manifest)
+    prune_snapshots()
 
-def download_database():
+def build_weapon_index(manifest_url):
+    """Build the weapon index for a manifest version from its snapshot, so workers only have to load it."""
+    store = definitions.SqliteDefinitionStore(get_snapshot_path(manifest_url))
+    try:
+        path = weapon_index.WeaponIndex.build(manifest_url, store).save()
+        print(f'Weapon index saved to {path}')
+    finally:
+        store.close()
+
+def get_snapshot_path(manifest_url):
     """
-    Downloads the new content database and overwrites the old one.
+    Content databases are stored side by side in MANIFEST_DIR, one file per manifest version.
+    The file name comes from the mobileWorldContentPaths url, which changes with every version.
     """
+    return os.path.join(Config.MANIFEST_DIR, os.path.basename(manifest_url))
 
-    print('Downloading new content database.')
-    manifest_url = get_manifest_url()
-    r = requests.get(manifest_url, headers=Config.BUNGIE_API_KEY, stream=True)
-    with open('newdb.zip', 'wb') as f:
-        for chunk in r.iter_content():
-            f.write(chunk)
-
-    print('New db downloaded to: newdb.zip')
-    with zipfile.ZipFile('newdb.zip', 'r') as zip_ref:
-        zip_ref.extractall('.')
-
-    print('Extracting newdb.zip')
-
-    files_in_dir = [f for f in os.listdir('.')]
-    db_file = [f for f in files_in_dir if '.content' in f][0]
-
-    print(f'DB extracted to {db_file}')
-    current_directory = os.getcwd()
-    src = os.path.join(current_directory, db_file)
-    dst = os.path.join(current_directory, 'db.sqlite3')
-    shutil.move(src, dst)
-    
-    print(f'{db_file} has been moved to db.sqlite3')
+def atomic_write(path, write):
+    """Write a file next to path and move it into place, so readers never see a partially written file."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def download_database(manifest_url=None, force=False):
+    """
+    Downloads the content database snapshot for a manifest version and returns its path.
+    The zip is streamed to a temporary file and the .content file is extracted next to the snapshot and then
+    renamed into place, so nothing ever reads a half-written file.
+    The download is skipped if the snapshot for this version already exists.
+    """
+    manifest_url = manifest_url or get_manifest_url()
+    path = get_snapshot_path(manifest_url)
+    if not force and os.path.isfile(path):
+        print(f'Content database {path} is already downloaded.')
+        return path
+
+    os.makedirs(Config.MANIFEST_DIR, exist_ok=True)
+    print(f'Downloading new content database: {manifest_url}')
+    r = utilities.get_session().get(manifest_url, stream=True)
+    r.raise_for_status()
+
+    with tempfile.TemporaryFile() as zip_file:
+        for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+            zip_file.write(chunk)
+
+        with zipfile.ZipFile(zip_file) as zip_ref:
+            db_file = [f for f in zip_ref.namelist() if '.content' in f][0]
+            print(f'Extracting {db_file}')
+            with zip_ref.open(db_file) as content:
+                atomic_write(path, lambda f: shutil.copyfileobj(content, f, DOWNLOAD_CHUNK_SIZE))
+
+    print(f'{db_file} has been saved to {path}')
+    return path
+
+def ensure_snapshot(manifest_url):
+    """Returns the path of the snapshot for a manifest version, downloading it first if this machine does not have it yet."""
+    path = get_snapshot_path(manifest_url)
+    if not os.path.isfile(path):
+        download_database(manifest_url)
+    return path
+
+def activate_snapshot(manifest_url):
+    """Atomically point MANIFEST_DB_PATH at the snapshot for a manifest version."""
+    path = get_snapshot_path(manifest_url)
+    tmp_link = f'{Config.MANIFEST_DB_PATH}.tmp'
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(path, tmp_link)
+    os.replace(tmp_link, Config.MANIFEST_DB_PATH)
+    print(f'{Config.MANIFEST_DB_PATH} now points to {path}')
+
+def prune_snapshots(keep=None):
+    """Delete all but the newest snapshots. Processes that still have an old snapshot open keep reading it until they switch."""
+    keep = keep or Config.MANIFEST_SNAPSHOTS_KEEP
+    if not os.path.isdir(Config.MANIFEST_DIR):
+        return
 
-    file_to_delete = os.path.join(current_directory, 'newdb.zip')
-    if os.path.isfile(file_to_delete):
-        os.remove(file_to_delete)
-        print('Deleted newdb.zip')
+    current = os.path.realpath(Config.MANIFEST_DB_PATH)
+    snapshots = [os.path.join(Config.MANIFEST_DIR, f) for f in os.listdir(Config.MANIFEST_DIR) if f.endswith('.content')]
+    snapshots = sorted(snapshots, key=os.path.getmtime, reverse=True)
+    for snapshot in snapshots[keep:]:
+        if os.path.realpath(snapshot) == current:
+            continue
+        os.remove(snapshot)
+        print(f'Deleted old content database {snapshot}')
 
-# TODO: Add code to add new database rows to postgres
+        index_path = weapon_index.get_index_path(snapshot)
+        if os.path.isfile(index_path):
+            os.remove(index_path)
 
 def query_sqlite_database(query):
-    sqlite_db_path = os.path.join(Config.PROJECT_ROOT, 'db.sqlite3')
-    connection = sqlite3.connect(sqlite_db_path)
+    connection = sqlite3.connect(Config.MANIFEST_DB_PATH)
     connection.row_factory = sqlite3.Row
     cursor = connection.cursor()
     cursor.execute(query)
@@ -117,27 +174,39 @@ def query_sqlite_database(query):
     connection.close()
     return rows
 
-def update_database():
+def update_database(batch_size=1000):
+    """
+    Copy new definitions from the content database into the Destiny*Definition tables.
+    Existing hashes are read once per table and diffed against the content database, then the new rows are
+    written with multi-row inserts in a single transaction per table.
+    """
     tables = [t[0] for t in query_sqlite_database("SELECT name FROM sqlite_master WHERE type='table';")]
     for table in tables:
-        table_data = query_sqlite_database(f'SELECT * FROM {table}')
-        for data in table_data:
-            tbl = getattr(models, table)
-            hash_id = str(data[0])
-            data = json.loads(data[1])
-            row = models.db.session.query(tbl).filter(tbl.hash==hash_id).first()
-            if row:
+        tbl = getattr(models, table, None)
+        if not tbl:
+            logger.warning(f'{table}: not found in models. Skipping.')
+            continue
+
+        start_time = time()
+        try:
+            existing_hashes = set(row.hash for row in models.db.session.query(tbl.hash))
+            # Columns by position: most tables are keyed by id, but some (e.g. DestinyHistoricalStatsDefinition) by key
+            table_data = query_sqlite_database(f'SELECT * FROM {table}')
+            new_rows = [{'hash': str(data[0]), 'json': json.loads(data[1])} for data in table_data if str(data[0]) not in existing_hashes]
+            if not new_rows:
+                logger.info(f'{table}: no new definitions')
                 continue
 
-            new = tbl(hash=hash_id, json=data)
-            models.db.session.add(new)
+            for i in range(0, len(new_rows), batch_size):
+                models.db.session.execute(tbl.__table__.insert().values(new_rows[i:i + batch_size]))
+            models.db.session.commit()
+        except Exception as e:
+            logger.warning(f'{table}: failed to add new definitions. Reason: {e}')
+            models.db.session.rollback()
+            continue
 
-            try:
-                models.db.session.commit()
-                logger.warning(f'{table}: successfully added hash {hash_id}')
-            except Exception as e:
-                logger.warning(f'{table}: failed to add hash {hash_id}. Reason: {e}')
-                models.db.session.rollback()
+        elapsed = time() - start_time
+        logger.info(f'{table}: added {len(new_rows)} definitions in {elapsed:.2f}s ({len(new_rows) / elapsed:.0f} rows/sec)')
 
     models.db.session.close()
 
@@ -0,0 +1,159 @@
+from datetime import datetime
+import json
+import zlib
+import redis
+from sqlalchemy import null
+from sqlalchemy.dialects.postgresql import insert
+from app import models
+from app.utils import log
+from config import Config
+
+logger = log.get_logger(__name__)
+
+# PGCRs are stored once per instanceId in the pgcr table and linked to every clan character that played
+# the match through pgcr_participant. A short-lived Redis key marks a PGCR that is being downloaded, so
+# consumers that pick up the same match for another character wait for it instead of fetching it again.
+INFLIGHT_KEY = 'pgcr:inflight:{}'
+
+_redis = None
+
+def get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis(host=Config.redis, port=6379, db=0)
+    return _redis
+
+def claim(pgcr_id):
+    """
+    Mark a PGCR as being downloaded by this process. Returns False if another process is already downloading it.
+    If Redis is unavailable, the claim always succeeds; the unique pgcr_id still keeps a single copy of the PGCR.
+    """
+    try:
+        return bool(get_redis().set(INFLIGHT_KEY.format(pgcr_id), 1, nx=True, ex=Config.PGCR_INFLIGHT_TTL))
+    except redis.RedisError as e:
+        logger.debug(f'{pgcr_id}: Could not claim PGCR. Reason: {e}')
+        return True
+
+def release(pgcr_id):
+    try:
+        get_redis().delete(INFLIGHT_KEY.format(pgcr_id))
+    except redis.RedisError as e:
+        logger.debug(f'{pgcr_id}: Could not release PGCR. Reason: {e}')
+
+def get_stored(pgcr_ids):
+    """Returns {pgcr_id: (pgcr.id, date)} for the PGCRs that are already stored."""
+    pgcr_ids = set(str(pgcr_id) for pgcr_id in pgcr_ids)
+    if not pgcr_ids:
+        return {}
+
+    rows = models.db.session.query(models.PostGameCarnageReport.pgcr_id, models.PostGameCarnageReport.id, models.PostGameCarnageReport.date) \
+        .filter(models.PostGameCarnageReport.pgcr_id.in_(pgcr_ids))
+    return {row.pgcr_id: (row.id, row.date) for row in rows}
+
+def slim_report(report, clan_characters):
+    """
+    Keep only what the site reads from a PGCR: the Response without the ErrorCode/Message envelope,
+    and extended stats (weapons, medals) only for clan characters.
+    """
+    response = dict(report['Response'])
+    entries = []
+    for entry in response.get('entries', []):
+        if entry.get('characterId') not in clan_characters:
+            entry = {k: v for k, v in entry.items() if k != 'extended'}
+        entries.append(entry)
+    response['entries'] = entries
+    return {'Response': response}
+
+def compress_report(report):
+    return zlib.compress(json.dumps(report, separators=(',', ':')).encode('utf-8'))
+
+def get_clan_characters():
+    return set(row.char_id for row in models.db.session.query(models.Characters.char_id))
+
+def get_date(report):
+    return datetime.strptime(report['Response']['period'], '%Y-%m-%dT%H:%M:%SZ')
+
+def get_value(entry, stat):
+    """Returns a stat from a PGCR entry's values as an int, or None if the activity does not report it."""
+    value = entry.get('values', {}).get(stat)
+    return int(value['basic']['value']) if value else None
+
+def extract_entries(report):
+    """The per-player facts stored in pgcr_entry, one dict per entry in the PGCR."""
+    response = report['Response']
+    details = response['activityDetails']
+    period = get_date(report)
+    entries = []
+    for entry in response.get('entries', []):
+        entries.append({
+            'character_id': str(entry['characterId']),
+            'membership_id': str(entry['player']['destinyUserInfo']['membershipId']),
+            'team': get_value(entry, 'team'),
+            'standing': entry.get('standing'),
+            'score': int(entry['score']['basic']['value']) if 'score' in entry else None,
+            'kills': get_value(entry, 'kills'),
+            'deaths': get_value(entry, 'deaths'),
+            'completed': get_value(entry, 'completed'),
+            'duration': get_value(entry, 'activityDurationSeconds'),
+            'activity_hash': str(details['directorActivityHash']),
+            'mode': details.get('mode'),
+            'modes': details.get('modes'),
+            'period': period
+        })
+    return entries
+
+def store_reports(reports):
+    """
+    Insert PGCRs that are not stored yet, in the current transaction.
+    Returns {pgcr_id: (pgcr.id, date)} for every PGCR in reports, including ones another process stored first.
+    """
+    if not reports:
+        return {}
+
+    compressed = Config.PGCR_STORAGE == 'compressed'
+    clan_characters = get_clan_characters() if compressed else None
+
+    values = {}
+    reports_by_id = {}
+    for report in reports:
+        pgcr_id = str(report['Response']['activityDetails']['instanceId'])
+        reports_by_id[pgcr_id] = report
+        values[pgcr_id] = {
+            'pgcr_id': pgcr_id,
+            'data': null() if compressed else report,
+            'blob': compress_report(slim_report(report, clan_characters)) if compressed else None,
+            'modes': report['Response']['activityDetails']['modes'],
+            'date': get_date(report)
+        }
+
+    table = models.PostGameCarnageReport.__table__
+    statement = insert(table).values(list(values.values())) \
+        .on_conflict_do_nothing(index_elements=['pgcr_id']) \
+        .returning(table.c.pgcr_id, table.c.id, table.c.date)
+    stored = {row.pgcr_id: (row.id, row.date) for row in models.db.session.execute(statement)}
+
+    # Entries are only extracted for the PGCRs inserted here; the others already have theirs
+    entries = []
+    for pgcr_id, (_id, date) in stored.items():
+        for entry in extract_entries(reports_by_id[pgcr_id]):
+            entry['pgcr'] = _id
+            entries.append(entry)
+    if entries:
+        models.db.session.execute(insert(models.PgcrEntry.__table__).values(entries).on_conflict_do_nothing(index_elements=['pgcr', 'character_id']))
+
+    missing = set(values) - set(stored)
+    if missing:
+        stored.update(get_stored(missing))
+    return stored
+
+def add_participants(participants):
+    """
+    Link characters to stored PGCRs, in the current transaction.
+    participants is a list of dicts with pgcr, parent_character, mode and date keys. Existing links are left alone.
+    """
+    if not participants:
+        return
+
+    statement = insert(models.PgcrParticipant.__table__).values(participants) \
+        .on_conflict_do_nothing(index_elements=['pgcr', 'parent_character', 'mode'])
+    models.db.session.execute(statement)
@@ -0,0 +1,72 @@
+from datetime import datetime
+from time import time
+import json
+import redis
+from app import models
+from app.utils import log
+from config import Config
+
+logger = log.get_logger(__name__)
+
+# Players are refreshed on an interval that depends on how recently they played, and queued by priority:
+# online players first, then everyone else by how long ago they last played.
+# A job is due once its interval has passed since it last completed (see RedisPriorityQueue.ack()), so the publishers
+# can run often and only queue the jobs that are due, and a job that was lost or failed is queued again on the next run.
+
+def get_last_played():
+    """Returns {membership_id: last_played} for every player in the database."""
+    return {str(row.membership_id): row.last_played for row in models.db.session.query(models.Players.membership_id, models.Players.last_played)}
+
+def get_idle_seconds(last_played, now):
+    """Seconds since a player last played, or None if we have never seen them play."""
+    if last_played is None:
+        return None
+    return max(0, (now - last_played).total_seconds())
+
+def get_priority(member, last_played, now):
+    """Queue score of a clan member, lower is refreshed first. Players we have never seen play come last."""
+    if member.get('isOnline'):
+        return 0
+    idle = get_idle_seconds(last_played, now)
+    return idle if idle is not None else time()
+
+def get_interval(member, last_played, now):
+    """Seconds between refreshes of a clan member."""
+    if member.get('isOnline'):
+        return Config.REFRESH_INTERVAL_ONLINE
+    idle = get_idle_seconds(last_played, now)
+    if idle is not None:
+        for played_within, interval in Config.REFRESH_INTERVALS:
+            if idle <= played_within:
+                return interval
+    return Config.REFRESH_INTERVAL_DORMANT
+
+def schedule(q, members):
+    """
+    Put the clan members that are due for a refresh on q, a RedisPriorityQueue.
+    members are the queue payloads: dicts with at least membershipId and isOnline. Returns the number of members that were due.
+    """
+    if not members:
+        return 0
+
+    now = datetime.utcnow()
+    last_played = get_last_played()
+    keys = [q.get_dedupe_key(json.dumps(member)) for member in members]
+    try:
+        last_done = q.get_done(keys)
+    except redis.RedisError as e:
+        logger.warning(f'Failed to read the refresh schedule of {q.name}, queuing every member. Reason: {e}')
+        last_done = [None] * len(keys)
+
+    items = []
+    scores = []
+    for member, done in zip(members, last_done):
+        player_last_played = last_played.get(str(member['membershipId']))
+        if done and time() - float(done) < get_interval(member, player_last_played, now):
+            continue
+        items.append(json.dumps(member))
+        scores.append(get_priority(member, player_last_played, now))
+
+    # Jobs that are still waiting are not added twice, see RedisPriorityQueue.put_many()
+    q.put_many(items, scores=scores)
+    return len(items)
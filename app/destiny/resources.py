@@ -1,5 +1,7 @@
-from flask import request
+from flask import current_app, request
 from flask_restplus import Namespace, Resource, fields, marshal_with
+from . import snapshot
+from .cache import cached
 from .client import DestinyAPI
 from . import api_rest
 
@@ -7,36 +9,50 @@ d2 = DestinyAPI()
 
 @api_rest.route('/info')
 class ResourceInfo(Resource):
+    @cached('info')
     def get(self):
         data = d2.get_service_info()
         return data
 
 @api_rest.route('/resources/roster')
 class ResourceRoster(Resource):
+    @cached('roster')
     def get(self):
+        snapshot_data = snapshot.get_roster()
+        if snapshot_data:
+            return current_app.response_class(snapshot_data, mimetype='application/json')
+
         data = d2.api_get_roster()
         return data
 
 @api_rest.route('/resources/player/<string:membership_id>')
 class ResourcePlayer(Resource):
+    @cached('players')
     def get(self, membership_id):
+        snapshot_data = snapshot.get_player(membership_id)
+        if snapshot_data:
+            return current_app.response_class(snapshot_data, mimetype='application/json')
+
         data = d2.api_get_player(membership_id)
         return data
 
 @api_rest.route('/resources/player/<string:membership_id>/weapons/<int:days>')
 class ResourcePlayerWeapons(Resource):
+    @cached('players', daily=True)
     def get(self, membership_id, days):
         data = d2.api_get_player_weapons(membership_id, days)
         return data
 
 @api_rest.route('/resources/player/<string:membership_id>/characters/<int:days>')
 class ResourcePlayerCharacters(Resource):
+    @cached('players', daily=True)
     def get(self, membership_id, days):
         data = d2.api_get_char_kills(membership_id, days)
         return data
 
 @api_rest.route('/resources/weapon/<string:weapon_id>')
 class ResourceWeapon(Resource):
+    @cached('weapons')
     def get(self, weapon_id):
         data = d2.api_get_weapon(weapon_id)
         if not data:
@@ -46,6 +62,7 @@ class ResourceWeapon(Resource):
 
 @api_rest.route('/resources/weapon/<string:weapon_id>/kills/<int:days>')
 class ResourceWeaponKills(Resource):
+    @cached('weapons', daily=True)
     def get(self, weapon_id, days):
         data = d2.api_get_weapon_kills(weapon_id, days)
         if not data:
@@ -55,6 +72,7 @@ class ResourceWeaponKills(Resource):
 
 @api_rest.route('/resources/collectible/<string:collectible_hash>')
 class ResourceColletible(Resource):
+    @cached('collectibles')
     def get(self, collectible_hash):
         data = d2.db_get_collectible(collectible_hash)
         if not data:
@@ -64,18 +82,21 @@ class ResourceColletible(Resource):
 
 @api_rest.route('/resources/collectibles')
 class ResourceCollectibles(Resource):
+    @cached('collectibles')
     def get(self):
         data = d2.api_get_collectible_exotics_owned()
         return data
 
 @api_rest.route('/resources/collectibles/unowned')
 class ResourceCollectiblesUnowned(Resource):
+    @cached('collectibles')
     def get(self):
         data = d2.api_get_collectible_exotics_unowned()
         return data
 
 @api_rest.route('/resources/weapontypes/<string:weapontype>/<int:days>')
 class ResourceWeaponTypes(Resource):
+    @cached('weapons', daily=True)
     def get(self, weapontype, days):
         if weapontype == 'all':
             data = d2.api_get_all_weapons(days)
@@ -89,6 +110,7 @@ class ResourceWeaponTypes(Resource):
 
 @api_rest.route('/resources/weapons/<string:category>/<int:days>')
 class ResourceWeaponCategoryKills(Resource):
+    @cached('weapons', daily=True)
     def get(self, category, days):
         category = ' '.join(category.split('_')).title()
         data = d2.api_get_weapon_category_kills(category, days)
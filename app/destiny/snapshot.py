@@ -0,0 +1,48 @@
+import json
+import redis
+from app.utils import log
+from config import Config
+
+logger = log.get_logger(__name__)
+
+# Fully serialized roster documents, rebuilt by the roster workers after they update players
+# and served by the API as-is, so the roster endpoints never query the database.
+ROSTER_KEY = 'snapshot:roster'
+PLAYER_KEY = 'snapshot:player:{}'
+
+_redis = None
+
+def get_redis():
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis(host=Config.redis, port=6379, db=0)
+    return _redis
+
+def publish_roster(roster):
+    """Store the roster (the output of DestinyAPI.api_get_roster()) and one document per player."""
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.setex(ROSTER_KEY, Config.SNAPSHOT_TTL, json.dumps(roster))
+        for player in roster:
+            pipe.setex(PLAYER_KEY.format(player['membership_id']), Config.SNAPSHOT_TTL, json.dumps(player))
+        pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f'Failed to publish the roster snapshot. Reason: {e}')
+        return False
+
+    logger.debug(f'Published roster snapshot with {len(roster)} players')
+    return True
+
+def get(key):
+    try:
+        return get_redis().get(key)
+    except redis.RedisError as e:
+        logger.debug(f'Failed to read snapshot {key}. Reason: {e}')
+        return
+
+def get_roster():
+    """Returns the serialized roster, or None if it has not been published."""
+    return get(ROSTER_KEY)
+
+def get_player(membership_id):
+    return get(PLAYER_KEY.format(membership_id))
@@ -0,0 +1,117 @@
+from collections import namedtuple
+from time import time
+import json
+import os
+from app.destiny import definitions
+from app.utils import log
+from config import Config
+
+logger = log.get_logger(__name__)
+
+WEAPON_ITEM_TYPE = 3
+
+WeaponInfo = namedtuple('WeaponInfo', ['name', 'weapon_type', 'subtype', 'tier'])
+
+def get_hash(_hash):
+    """Same conversion as DestinyAPI.get_hash(): the signed version of an item hash."""
+    _hash = int(_hash)
+    if (_hash & (1 << (32 - 1))) != 0:
+        _hash = _hash - (1 << 32)
+    return _hash
+
+def get_index_path(manifest_url):
+    return os.path.join(Config.MANIFEST_DIR, f'{os.path.basename(manifest_url)}.weapons.json')
+
+class WeaponIndex(object):
+    """
+    Every weapon in one manifest version, keyed by signed item hash: name, weapon type (kinetic/energy/power),
+    subtype (Hand Cannon, Sniper Rifle...) and tier. Built once per manifest and saved as a small JSON file
+    next to the content database snapshot, so PGCR processing resolves weapons without any definition lookups.
+    """
+    def __init__(self, manifest_url, weapons):
+        self.manifest_url = manifest_url
+        self.weapons = weapons
+
+    def get(self, weapon_hash):
+        """Look up a weapon by its signed hash, as returned by get_hash()."""
+        return self.weapons.get(int(weapon_hash))
+
+    def __len__(self):
+        return len(self.weapons)
+
+    @classmethod
+    def build(cls, manifest_url, store=None):
+        """Build the index from a definition store (defaults to the store currently in use)."""
+        start_time = time()
+        store = store or definitions.get_store()
+        buckets = {}
+        for bucket in store.get_all('DestinyInventoryBucketDefinition'):
+            name = bucket.json.get('displayProperties', {}).get('name')
+            if name:
+                buckets[bucket.json['hash']] = name.lower().split(' ')[0]
+
+        weapons = {}
+        for item in store.get_all('DestinyInventoryItemDefinition'):
+            data = item.json
+            if data.get('itemType') != WEAPON_ITEM_TYPE or 'inventory' not in data:
+                continue
+
+            name = data['displayProperties']['name']
+            subtype = data.get('itemTypeDisplayName') if name != 'Classified' else 'Classified'
+            weapons[get_hash(data['hash'])] = WeaponInfo(
+                name=name,
+                weapon_type=buckets.get(data['inventory']['bucketTypeHash']),
+                subtype=subtype,
+                tier=data['inventory'].get('tierTypeName')
+            )
+
+        logger.info(f'Built weapon index with {len(weapons)} weapons in {time() - start_time:.2f}s')
+        return cls(manifest_url, weapons)
+
+    def save(self):
+        path = get_index_path(self.manifest_url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({str(k): list(v) for k, v in self.weapons.items()}, f, separators=(',', ':'))
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, manifest_url):
+        """Load the saved index for a manifest version. Returns None if it has not been built yet."""
+        path = get_index_path(manifest_url)
+        if not os.path.isfile(path):
+            return
+
+        with open(path) as f:
+            data = json.load(f)
+
+        return cls(manifest_url, {int(k): WeaponInfo(*v) for k, v in data.items()})
+
+_index = None
+
+def get_index():
+    """
+    Return the weapon index for the manifest version currently in use, loading it from disk
+    (or building and saving it if this machine does not have it yet) after a manifest change.
+    """
+    global _index
+    definitions.cache.check_manifest()
+    manifest_url = definitions.cache.manifest_url
+    if _index is not None and _index.manifest_url == manifest_url:
+        return _index
+
+    if not manifest_url:
+        return
+
+    index = WeaponIndex.load(manifest_url)
+    if index is None:
+        index = WeaponIndex.build(manifest_url)
+        try:
+            index.save()
+        except OSError as e:
+            logger.warning(f'Failed to save weapon index for {manifest_url}. Reason: {e}')
+
+    _index = index
+    return _index
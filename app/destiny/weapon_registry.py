@@ -0,0 +1,59 @@
+from sqlalchemy.dialects.postgresql import insert
+from app import models
+from app.utils import log
+
+logger = log.get_logger(__name__)
+
+class WeaponRegistry(object):
+    """
+    In-memory map of weapon_id and weapon name to Weapons.id.
+    The weapon table is read once, then new weapons are added as they are upserted, so storing a weapon line
+    from a PGCR costs no queries for weapons we have already seen. Weapons are deduplicated by name (the unique key),
+    so several item hashes can point at the same row.
+    """
+    def __init__(self):
+        self.by_weapon_id = {}
+        self.by_name = {}
+        self.loaded = False
+
+    def warm(self):
+        self.by_weapon_id.clear()
+        self.by_name.clear()
+        for row in models.db.session.query(models.Weapons.id, models.Weapons.weapon_id, models.Weapons.name):
+            self.by_weapon_id[str(row.weapon_id)] = row.id
+            self.by_name[row.name] = row.id
+        self.loaded = True
+        logger.info(f'Loaded {len(self.by_name)} weapons into the weapon registry')
+
+    def clear(self):
+        """Forget every weapon, e.g. after a rollback or a rename. The table is read again on the next lookup."""
+        self.by_weapon_id.clear()
+        self.by_name.clear()
+        self.loaded = False
+
+    def get_id(self, weapon_id, name, damage_type=None, gun_type=None):
+        """Return the Weapons.id for a weapon, inserting it in the current transaction if it is new."""
+        if not self.loaded:
+            self.warm()
+
+        weapon_id = str(weapon_id)
+        _id = self.by_weapon_id.get(weapon_id) or self.by_name.get(name)
+        if _id is None:
+            _id = self.upsert(weapon_id, name, damage_type, gun_type)
+
+        self.by_weapon_id[weapon_id] = _id
+        self.by_name[name] = _id
+        return _id
+
+    def upsert(self, weapon_id, name, damage_type, gun_type):
+        # Another worker may have added the same weapon since we warmed, in which case nothing is returned
+        statement = insert(models.Weapons.__table__) \
+            .values(weapon_id=weapon_id, name=name, damage_type=damage_type, gun_type=gun_type) \
+            .on_conflict_do_nothing(index_elements=['name']) \
+            .returning(models.Weapons.__table__.c.id)
+        row = models.db.session.execute(statement).first()
+        if row is None:
+            row = models.db.session.query(models.Weapons.id).filter(models.Weapons.name==name).first()
+        return row[0]
+
+registry = WeaponRegistry()
@@ -1,8 +1,11 @@
+import json
+import zlib
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy import create_engine
-from sqlalchemy import Column, Integer, String, DateTime, Numeric, ForeignKey, Boolean, JSON, PickleType
+from sqlalchemy import Column, Integer, String, Date, DateTime, Numeric, ForeignKey, Boolean, JSON, UniqueConstraint, LargeBinary, Index
+from sqlalchemy.dialects.postgresql import ARRAY
 from flask_marshmallow import Marshmallow
 from config import Config
 
@@ -13,7 +16,7 @@ class Players(db.Model):
     __tablename__ = 'player'
     id = Column(Integer, primary_key=True)
     name = Column(String)
-    membership_id = Column(String)
+    membership_id = Column(String, index=True)
     membership_type = Column(Integer)
     last_updated = Column(DateTime)
     last_played = Column(DateTime)
@@ -31,7 +34,7 @@ class Players(db.Model):
 class Stats(db.Model):
     __tablename__ = 'playerstats'
     id = Column(Integer, primary_key=True)
-    parent_player = Column(Integer, ForeignKey('player.id'))
+    parent_player = Column(Integer, ForeignKey('player.id'), index=True)
     glory = Column(Integer)
     stat = Column(String)
     value = Column(Numeric)
@@ -39,8 +42,9 @@ class Stats(db.Model):
 
 class RaidStats(db.Model):
     __tablename__ = 'raidstats'
+    __table_args__ = (UniqueConstraint('pgcr_id', 'parent_char'),)
     id = Column(Integer, primary_key=True)
-    parent_char = Column(Integer, ForeignKey('character.id'))
+    parent_char = Column(Integer, ForeignKey('character.id'), index=True)
     pgcr_id = Column(String)
     activity = Column(String)
     activity_hash = Column(String)
@@ -60,32 +64,58 @@ class AggregateActivityStats(db.Model):
 class Characters(db.Model):
     __tablename__ = 'character'
     id = Column(Integer, primary_key=True)
-    parent_id = Column(Integer, ForeignKey('player.id'))
-    char_id = Column(String)
+    parent_id = Column(Integer, ForeignKey('player.id'), index=True)
+    char_id = Column(String, index=True)
     last_pvp_match = Column(String)
     class_name = Column(String)
     power = Column(Integer)
     children = relationship("WeaponsData")
-    children_pgcr = relationship("PostGameCarnageReport")
+    children_pgcr = relationship("PgcrParticipant")
     children_raidstats = relationship("RaidStats")
 
 class WeaponsData(db.Model):
     __tablename__ = 'weapondata'
+    __table_args__ = (
+        Index('ix_weapondata_parent_id_match_time', 'parent_id', 'match_time'),
+        Index('ix_weapondata_parent_weapon_match_time', 'parent_weapon', 'match_time'),
+    )
     id = Column(Integer, primary_key=True)
     parent_id = Column(Integer, ForeignKey('character.id'))
     parent_weapon = Column(Integer, ForeignKey('weapon.id'))
     kills = Column(Integer)
-    match_time = Column(DateTime)
+    match_time = Column(DateTime, index=True)
+
+class WeaponKillsDaily(db.Model):
+    """Kills per day, character and weapon, rolled up from WeaponsData as matches are processed."""
+    __tablename__ = 'weapon_kills_daily'
+    __table_args__ = (
+        UniqueConstraint('day', 'parent_id', 'parent_weapon'),
+        Index('ix_weapon_kills_daily_parent_id_day', 'parent_id', 'day'),
+        Index('ix_weapon_kills_daily_parent_weapon_day', 'parent_weapon', 'day'),
+    )
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, index=True)
+    parent_id = Column(Integer, ForeignKey('character.id'))
+    parent_weapon = Column(Integer, ForeignKey('weapon.id'))
+    kills = Column(Integer)
 
 class Weapons(db.Model):
     __tablename__ = 'weapon'
     id = Column(Integer, primary_key=True)
-    weapon_id = Column(String)
-    name = Column(String)
+    weapon_id = Column(String, index=True)
+    name = Column(String, unique=True)
     damage_type = Column(String)
     gun_type = Column(String)
     children = relationship("WeaponsData")
 
+class Watermark(db.Model):
+    """The last row processed by an incremental job, e.g. the last pgcr_participant row turned into RaidStats."""
+    __tablename__ = 'watermark'
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True)
+    last_id = Column(Integer)
+    updated = Column(DateTime)
+
 class Manifest(db.Model):
     __tablename__ = 'manifest'
     id = Column(Integer, primary_key=True)
@@ -96,14 +126,14 @@ class Manifest(db.Model):
 class CollectiblesPlayer(db.Model):
     __tablename__ = 'collectibles_player'
     id = Column(Integer, primary_key=True)
-    parent_player = Column(Integer, ForeignKey('player.id'))
-    parent_collectible = Column(Integer, ForeignKey('collectibles_game.id'))
+    parent_player = Column(Integer, ForeignKey('player.id'), index=True)
+    parent_collectible = Column(Integer, ForeignKey('collectibles_game.id'), index=True)
     date_collected = Column(DateTime)
 
 class CollectiblesGame(db.Model):
     __tablename__ = 'collectibles_game'
     id = Column(Integer, primary_key=True)
-    collectible_hash = Column(String)
+    collectible_hash = Column(String, index=True)
     item_hash = Column(String)
     icon_url = Column(String)
     name = Column(String)
@@ -115,299 +145,344 @@ class CollectiblesGame(db.Model):
 class PostGameCarnageReport(db.Model):
     __tablename__ = 'pgcr'
     id = Column(Integer, primary_key=True)
-    pgcr_id = Column(String)
+    pgcr_id = Column(String, unique=True)
     data = Column(JSON)
+    # zlib compressed JSON of the slimmed PGCR, see Config.PGCR_STORAGE
+    blob = Column(LargeBinary)
+    modes = Column(ARRAY(Integer))
+    date = Column(DateTime, index=True)
+    participants = relationship("PgcrParticipant")
+    entries = relationship("PgcrEntry")
+
+    @property
+    def report(self):
+        """The PGCR in the API's {'Response': ...} shape, whichever format it was stored in."""
+        if self.blob is not None:
+            return json.loads(zlib.decompress(self.blob).decode('utf-8'))
+        return self.data
+
+class PgcrEntry(db.Model):
+    """One player's stats in a PGCR, extracted when the PGCR is stored so that reports can be built in SQL."""
+    __tablename__ = 'pgcr_entry'
+    __table_args__ = (
+        UniqueConstraint('pgcr', 'character_id'),
+        Index('ix_pgcr_entry_modes', 'modes', postgresql_using='gin'),
+    )
+    id = Column(Integer, primary_key=True)
+    pgcr = Column(Integer, ForeignKey('pgcr.id'), index=True)
+    character_id = Column(String, index=True)
+    membership_id = Column(String)
+    team = Column(Integer)
+    standing = Column(Integer)
+    score = Column(Integer)
+    kills = Column(Integer)
+    deaths = Column(Integer)
+    completed = Column(Integer)
+    duration = Column(Integer)
+    activity_hash = Column(String)
+    mode = Column(Integer)
+    modes = Column(ARRAY(Integer))
+    period = Column(DateTime)
+
+class PgcrParticipant(db.Model):
+    """A clan character that played in a PGCR. mode is the activity mode the match was collected for."""
+    __tablename__ = 'pgcr_participant'
+    __table_args__ = (
+        UniqueConstraint('pgcr', 'parent_character', 'mode'),
+        Index('ix_pgcr_participant_parent_character_mode_date', 'parent_character', 'mode', 'date'),
+    )
+    id = Column(Integer, primary_key=True)
+    pgcr = Column(Integer, ForeignKey('pgcr.id'))
+    parent_character = Column(Integer, ForeignKey('character.id'), index=True)
     mode = Column(Integer)
-    modes = Column(PickleType)
     date = Column(DateTime)
-    parent_character = Column(Integer, ForeignKey('character.id'))
 
 class DestinyEnemyRaceDefinition(db.Model):
     __tablename__ = 'DestinyEnemyRaceDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyPlaceDefinition(db.Model):
     __tablename__ = 'DestinyPlaceDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyActivityDefinition(db.Model):
     __tablename__ = 'DestinyActivityDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyActivityTypeDefinition(db.Model):
     __tablename__ = 'DestinyActivityTypeDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyClassDefinition(db.Model):
     __tablename__ = 'DestinyClassDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyGenderDefinition(db.Model):
     __tablename__ = 'DestinyGenderDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyInventoryBucketDefinition(db.Model):
     __tablename__ = 'DestinyInventoryBucketDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyRaceDefinition(db.Model):
     __tablename__ = 'DestinyRaceDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyTalentGridDefinition(db.Model):
     __tablename__ = 'DestinyTalentGridDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyUnlockDefinition(db.Model):
     __tablename__ = 'DestinyUnlockDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyMaterialRequirementSetDefinition(db.Model):
     __tablename__ = 'DestinyMaterialRequirementSetDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinySandboxPerkDefinition(db.Model):
     __tablename__ = 'DestinySandboxPerkDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyStatGroupDefinition(db.Model):
     __tablename__ = 'DestinyStatGroupDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyFactionDefinition(db.Model):
     __tablename__ = 'DestinyFactionDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyVendorGroupDefinition(db.Model):
     __tablename__ = 'DestinyVendorGroupDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyRewardSourceDefinition(db.Model):
     __tablename__ = 'DestinyRewardSourceDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyItemCategoryDefinition(db.Model):
     __tablename__ = 'DestinyItemCategoryDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyDamageTypeDefinition(db.Model):
     __tablename__ = 'DestinyDamageTypeDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyActivityModeDefinition(db.Model):
     __tablename__ = 'DestinyActivityModeDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyMedalTierDefinition(db.Model):
     __tablename__ = 'DestinyMedalTierDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyAchievementDefinition(db.Model):
     __tablename__ = 'DestinyAchievementDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyActivityGraphDefinition(db.Model):
     __tablename__ = 'DestinyActivityGraphDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyCollectibleDefinition(db.Model):
     __tablename__ = 'DestinyCollectibleDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyStatDefinition(db.Model):
     __tablename__ = 'DestinyStatDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyItemTierTypeDefinition(db.Model):
     __tablename__ = 'DestinyItemTierTypeDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyPresentationNodeDefinition(db.Model):
     __tablename__ = 'DestinyPresentationNodeDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyRecordDefinition(db.Model):
     __tablename__ = 'DestinyRecordDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyBondDefinition(db.Model):
     __tablename__ = 'DestinyBondDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyDestinationDefinition(db.Model):
     __tablename__ = 'DestinyDestinationDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyEquipmentSlotDefinition(db.Model):
     __tablename__ = 'DestinyEquipmentSlotDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyInventoryItemDefinition(db.Model):
     __tablename__ = 'DestinyInventoryItemDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyLocationDefinition(db.Model):
     __tablename__ = 'DestinyLocationDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyLoreDefinition(db.Model):
     __tablename__ = 'DestinyLoreDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyObjectiveDefinition(db.Model):
     __tablename__ = 'DestinyObjectiveDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyProgressionDefinition(db.Model):
     __tablename__ = 'DestinyProgressionDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyProgressionLevelRequirementDefinition(db.Model):
     __tablename__ = 'DestinyProgressionLevelRequirementDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinySackRewardItemListDefinition(db.Model):
     __tablename__ = 'DestinySackRewardItemListDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinySandboxPatternDefinition(db.Model):
     __tablename__ = 'DestinySandboxPatternDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinySeasonDefinition(db.Model):
     __tablename__ = 'DestinySeasonDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinySocketCategoryDefinition(db.Model):
     __tablename__ = 'DestinySocketCategoryDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinySocketTypeDefinition(db.Model):
     __tablename__ = 'DestinySocketTypeDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyVendorDefinition(db.Model):
     __tablename__ = 'DestinyVendorDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyMilestoneDefinition(db.Model):
     __tablename__ = 'DestinyMilestoneDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyActivityModifierDefinition(db.Model):
     __tablename__ = 'DestinyActivityModifierDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyReportReasonCategoryDefinition(db.Model):
     __tablename__ = 'DestinyReportReasonCategoryDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyPlugSetDefinition(db.Model):
     __tablename__ = 'DestinyPlugSetDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyChecklistDefinition(db.Model):
     __tablename__ = 'DestinyChecklistDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 class DestinyHistoricalStatsDefinition(db.Model):
     __tablename__ = 'DestinyHistoricalStatsDefinition'
     id = Column(Integer, primary_key=True)
-    hash = Column(String)
+    hash = Column(String, unique=True)
     json = Column(JSON)
 
 # API Schema
@@ -453,4 +528,4 @@ class CollectibleSchema(ma.Schema):
 class WeaponCategoryKillsSchema(ma.Schema):
     class Meta:
         ordered = True
-        fields = ('name', 'weapon_id', 'total_kills')
\ No newline at end of file
+        fields = ('name', 'weapon_id', 'total_kills')
\ No newline at end of file
@@ -0,0 +1,116 @@
+import asyncio
+from time import sleep
+import redis
+from config import Config
+from app.utils import log
+
+logger = log.get_logger(__name__)
+
+# PlatformErrorCodes returned when a request is rejected because of throttling
+# https://bungie-net.github.io/multi/schema_Exceptions-PlatformErrorCodes.html
+THROTTLE_ERROR_CODES = [31, 32, 33, 36, 51, 52, 53, 54, 55]
+
+# Token bucket shared by every process that uses the same Redis server.
+# Returns 0 when a token was taken, otherwise the number of milliseconds to wait before trying again.
+TOKEN_BUCKET_SCRIPT = """
+redis.replicate_commands()
+
+local throttled = redis.call('PTTL', KEYS[2])
+if throttled > 0 then
+    return throttled
+end
+
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+local tokens = tonumber(bucket[1]) or burst
+local timestamp = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + (now - timestamp) * rate / 1000)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'timestamp', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+return wait
+"""
+
+class RateLimiter(object):
+    """
+    Distributed token bucket for the Bungie API, shared by every worker through Redis.
+    Requests are spread out at `rate` requests per second with bursts of up to `burst` requests.
+    When the API asks us to back off (ThrottleSeconds), every worker pauses until the throttle expires.
+    If Redis is unavailable, requests are let through rather than blocking the workers.
+    """
+    def __init__(self, name='bungie', rate=None, burst=None):
+        self.rate = rate if rate is not None else Config.BUNGIE_RATE_LIMIT
+        self.burst = burst if burst is not None else Config.BUNGIE_RATE_BURST
+        self.bucket_key = f'ratelimit:{name}:bucket'
+        self.throttle_key = f'ratelimit:{name}:throttled'
+        self.__db = redis.Redis(host=Config.redis, port=6379, db=0)
+        self.script = self.__db.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def reserve(self):
+        """Try to take a token. Returns 0 on success, otherwise the number of seconds to wait before trying again."""
+        if not self.rate:
+            return 0
+
+        try:
+            wait = self.script(keys=[self.bucket_key, self.throttle_key], args=[self.rate, self.burst])
+        except redis.RedisError as e:
+            logger.debug(f'Rate limiter unavailable, not limiting request. Reason: {e}')
+            return 0
+
+        return wait / 1000
+
+    def acquire(self):
+        """Block until a token is available."""
+        while True:
+            wait = self.reserve()
+            if wait <= 0:
+                return
+            sleep(wait)
+
+    async def acquire_async(self):
+        """Wait until a token is available without blocking the event loop."""
+        while True:
+            wait = self.reserve()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def throttle(self, seconds):
+        """Stop all workers from sending requests for the given number of seconds."""
+        milliseconds = int(seconds * 1000)
+        try:
+            if self.__db.pttl(self.throttle_key) < milliseconds:
+                self.__db.set(self.throttle_key, 1, px=milliseconds)
+        except redis.RedisError as e:
+            logger.debug(f'Rate limiter unavailable, could not set throttle. Reason: {e}')
+
+def get_throttle_seconds(data):
+    """Returns the number of seconds the API asked us to wait, or 0."""
+    if not isinstance(data, dict):
+        return 0
+
+    throttle_seconds = data.get('ThrottleSeconds') or 0
+    if data.get('ErrorCode') in THROTTLE_ERROR_CODES:
+        throttle_seconds = max(throttle_seconds, 1)
+
+    return throttle_seconds
+
+_rate_limiter = None
+
+def get_rate_limiter():
+    """Return the process-wide rate limiter for the Bungie API."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter()
+    return _rate_limiter
@@ -1,14 +1,158 @@
+import json
 import logging
 import os
 import sys
-from time import sleep
+from time import sleep, time
 import redis
+from config import Config
 from app.utils import log
 
 logger = log.get_logger(__name__)
 
+# Reliable queues pop with RPOPLPUSH, so new items are pushed on the left to keep them FIFO.
+# An item stays in queue:<name>:processing with a lease in queue:<name>:leases until it is acked.
+# Items whose lease expired go back on the queue, or to queue:<name>:dead once they were delivered max_deliveries times.
+DEAD_LETTER_SIZE = 10000
+
+# Queues with dedupe fields (Config.QUEUE_DEDUPE_KEYS) keep the key of every waiting job in queue:<name>:pending,
+# scored by the time it was enqueued, and skip items whose job is already waiting. Keys are removed when the job
+# is popped, and keys older than ARGV[2] ms are ignored so that a consumer that died mid-pop cannot block a job forever.
+# Returns the number of items added.
+ENQUEUE_SCRIPT = """
+redis.replicate_commands()
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local expired = now - tonumber(ARGV[2])
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', expired)
+
+local added = 0
+for i = 3, #ARGV, 2 do
+    if redis.call('ZADD', KEYS[2], 'NX', now, ARGV[i]) == 1 then
+        redis.call(ARGV[1], KEYS[1], ARGV[i + 1])
+        added = added + 1
+    end
+end
+return added
+"""
+
+POP_SCRIPT = """
+redis.replicate_commands()
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local items = {}
+for i = 1, tonumber(ARGV[1]) do
+    local item = redis.call('RPOPLPUSH', KEYS[1], KEYS[2])
+    if not item then
+        break
+    end
+    redis.call('ZADD', KEYS[3], now + tonumber(ARGV[2]), item)
+    redis.call('HINCRBY', KEYS[4], item, 1)
+    items[i] = item
+end
+return items
+"""
+
+LEASE_SCRIPT = """
+redis.replicate_commands()
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[1])
+return redis.call('HINCRBY', KEYS[2], ARGV[1], 1)
+"""
+
+# ARGV[4..] are pairs of expired items and their dedupe keys ('' if the queue has none), read by ReliableQueue.reap().
+# Requeued items are marked as waiting again in queue:<name>:pending. Returns {requeued, dead}
+REAP_SCRIPT = """
+redis.replicate_commands()
+
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+
+-- A consumer that died between BRPOPLPUSH and taking the lease leaves an item without one
+for _, item in ipairs(redis.call('LRANGE', KEYS[2], 0, -1)) do
+    if not redis.call('ZSCORE', KEYS[3], item) then
+        redis.call('ZADD', KEYS[3], now + tonumber(ARGV[2]), item)
+    end
+end
+
+local requeued = 0
+local dead = 0
+for i = 4, #ARGV, 2 do
+    local item = ARGV[i]
+    local lease = tonumber(redis.call('ZSCORE', KEYS[3], item))
+    if lease and lease <= now then
+        redis.call('ZREM', KEYS[3], item)
+        if redis.call('LREM', KEYS[2], 1, item) > 0 then
+            local deliveries = tonumber(redis.call('HGET', KEYS[4], item)) or 0
+            if deliveries >= tonumber(ARGV[1]) then
+                redis.call('HDEL', KEYS[4], item)
+                redis.call('LPUSH', KEYS[5], item)
+                redis.call('LTRIM', KEYS[5], 0, tonumber(ARGV[3]) - 1)
+                dead = dead + 1
+            else
+                redis.call('RPUSH', KEYS[1], item)
+                if ARGV[i + 1] ~= '' then
+                    redis.call('ZADD', KEYS[6], now, ARGV[i + 1])
+                end
+                requeued = requeued + 1
+            end
+        else
+            redis.call('HDEL', KEYS[4], item)
+        end
+    end
+end
+return {requeued, dead}
+"""
+
+# Priority queues keep one member per job (its dedupe key) in a sorted set and the job's latest payload in a hash.
+# Queuing a job that is already waiting replaces its payload and keeps the lower of the two scores.
+# Returns the number of jobs added.
+PRIORITY_ENQUEUE_SCRIPT = """
+local added = 0
+for i = 1, #ARGV, 3 do
+    local score = tonumber(ARGV[i + 1])
+    local queued = redis.call('ZSCORE', KEYS[1], ARGV[i])
+    if not queued then
+        redis.call('ZADD', KEYS[1], score, ARGV[i])
+        added = added + 1
+    elseif score < tonumber(queued) then
+        redis.call('ZADD', KEYS[1], score, ARGV[i])
+    end
+    redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 2])
+end
+return added
+"""
+
+PRIORITY_POP_SCRIPT = """
+local popped = redis.call('ZPOPMIN', KEYS[1], ARGV[1])
+local items = {}
+for i = 1, #popped, 2 do
+    local item = redis.call('HGET', KEYS[2], popped[i])
+    if item then
+        redis.call('HDEL', KEYS[2], popped[i])
+        table.insert(items, item)
+    end
+end
+return items
+"""
+
+# Takes the payload of a job popped with BZPOPMIN. If a publisher queued the job again in the meantime,
+# the payload is left for the queued copy instead of being deleted from under it.
+PRIORITY_TAKE_SCRIPT = """
+local item = redis.call('HGET', KEYS[2], ARGV[1])
+if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+return item
+"""
+
 class RedisQueue(object):
     """Simple Queue with Redis Backend"""
+    push_command = 'RPUSH'
+
     def __init__(self, name, namespace='queue', **redis_kwargs):
         '''
         With k8s, this should no longer be necessary
@@ -18,16 +162,20 @@ class RedisQueue(object):
             self.redis_server = 'sfredis'
         '''
 
-        self.__db = redis.Redis(host="sfredis", port=6379, db=0)
+        self._db = redis.Redis(host="sfredis", port=6379, db=0)
+        self.name = name
         self.key = '%s:%s' %(namespace, name)
+        self.pending_key = f'{self.key}:pending'
+        self.dedupe_fields = Config.QUEUE_DEDUPE_KEYS.get(name)
+        self.enqueue_script = self._db.register_script(ENQUEUE_SCRIPT)
 
     def ping(self):
         """Ping the redis server."""
-        return self.__db.ping()
+        return self._db.ping()
 
     def qsize(self):
         """Return the approximate size of the queue."""
-        return self.__db.llen(self.key)
+        return self._db.llen(self.key)
 
     def empty(self):
         """Return True if the queue is empty, False otherwise."""
@@ -35,7 +183,44 @@ class RedisQueue(object):
 
     def put(self, item):
         """Put item into the queue."""
-        self.__db.rpush(self.key, item)
+        return self.put_many([item])
+
+    def put_many(self, items, chunk_size=1000):
+        """Put items into the queue with one multi-value push per chunk_size items, sent in a single pipeline.
+        On queues with dedupe fields, items whose job is already waiting are skipped. Returns the number of items added."""
+        if not items:
+            return 0
+
+        if self.dedupe_fields:
+            return self.put_unique(items, chunk_size)
+
+        pipe = self._db.pipeline(transaction=False)
+        for i in range(0, len(items), chunk_size):
+            pipe.execute_command(self.push_command, self.key, *items[i:i + chunk_size])
+        pipe.execute()
+        return len(items)
+
+    def put_unique(self, items, chunk_size):
+        added = 0
+        for i in range(0, len(items), chunk_size):
+            args = [self.push_command, Config.QUEUE_DEDUPE_TTL * 1000]
+            for item in items[i:i + chunk_size]:
+                args.extend([self.get_dedupe_key(item), item])
+            added = added + self.enqueue_script(keys=[self.key, self.pending_key], args=args)
+        return added
+
+    def get_dedupe_key(self, item):
+        """The job an item belongs to, e.g. '4611686018467284386:5' for a player and mode."""
+        if isinstance(item, bytes):
+            item = item.decode('utf-8')
+        data = json.loads(item)
+        return ':'.join(str(data[field]) for field in self.dedupe_fields)
+
+    def forget(self, *items):
+        """Remove the dedupe keys of popped items, so their jobs can be enqueued again."""
+        if not self.dedupe_fields or not items:
+            return
+        self._db.zrem(self.pending_key, *[self.get_dedupe_key(item) for item in items])
 
     def get(self, block=True, timeout=None):
         """Remove and return an item from the queue. 
@@ -43,25 +228,283 @@ class RedisQueue(object):
         If optional args block is true and timeout is None (the default), block
         if necessary until an item is available."""
         if block:
-            item = self.__db.blpop(self.key, timeout=timeout)
+            item = self._db.blpop(self.key, timeout=timeout)
         else:
-            item = self.__db.lpop(self.key)
+            item = self._db.lpop(self.key)
 
         if item:
             item = item[1]
+            self.forget(item)
         return item
 
     def get_nowait(self):
         """Equivalent to get(False)."""
         return self.get(False)
 
+    def get_many(self, size, block=True, timeout=None):
+        """Remove and return up to size items from the queue.
+        If block is true and the queue is empty, block until one item is available."""
+        items = self.pop_many(size)
+        self.forget(*items)
+        if items or not block:
+            return items
+
+        item = self.get(timeout=timeout)
+        if not item:
+            return []
+        return [item] + self.get_many(size - 1, block=False) if size > 1 else [item]
+
+    def pop_many(self, size):
+        """LPOP with a count needs Redis 6.2, so the items are read and trimmed with LRANGE + LTRIM in one MULTI/EXEC."""
+        pipe = self._db.pipeline()
+        pipe.lrange(self.key, 0, size - 1)
+        pipe.ltrim(self.key, size, -1)
+        return pipe.execute()[0]
+
+    def ack(self, *items):
+        """Items are removed from the queue when they are popped, so there is nothing to acknowledge."""
+        pass
+
+    def requeue(self, pipe, items):
+        """Push items back on the queue even if their job is waiting already, and mark their jobs as waiting again."""
+        pipe.execute_command(self.push_command, self.key, *items)
+        if self.dedupe_fields:
+            pipe.zadd(self.pending_key, {self.get_dedupe_key(item): int(time() * 1000) for item in items})
+
+    def release(self, *items):
+        """Put items that were popped but not processed back on the queue."""
+        if not items:
+            return
+
+        pipe = self._db.pipeline()
+        self.requeue(pipe, items)
+        pipe.execute()
+
+class ReliableQueue(RedisQueue):
+    """
+    Queue whose items are only removed once a consumer acks them.
+    Popped items are kept in a processing list with a lease of visibility_timeout seconds. Consumers reap
+    expired leases while they poll the queue, so the items of a consumer that crashed are delivered again,
+    and items that keep failing end up in a dead letter list instead of being retried forever.
+    """
+    # Items are popped from the right, so they are pushed on the left
+    push_command = 'LPUSH'
+
+    def __init__(self, name, namespace='queue', visibility_timeout=None, max_deliveries=None, reap_interval=None):
+        super(ReliableQueue, self).__init__(name, namespace)
+        self.processing_key = f'{self.key}:processing'
+        self.leases_key = f'{self.key}:leases'
+        self.deliveries_key = f'{self.key}:deliveries'
+        self.dead_key = f'{self.key}:dead'
+        self.visibility_timeout = visibility_timeout or Config.QUEUE_VISIBILITY_TIMEOUT
+        self.max_deliveries = max_deliveries or Config.QUEUE_MAX_DELIVERIES
+        self.reap_interval = reap_interval or Config.QUEUE_REAP_INTERVAL
+        self.last_reaped = 0
+        self.pop_script = self._db.register_script(POP_SCRIPT)
+        self.lease_script = self._db.register_script(LEASE_SCRIPT)
+        self.reap_script = self._db.register_script(REAP_SCRIPT)
+
+    def get(self, block=True, timeout=None):
+        """Move an item to the processing list and return it. The item is delivered again unless it is acked in time.
+
+        If optional args block is true and timeout is None (the default), block
+        if necessary until an item is available."""
+        self.reap_if_due()
+        if not block:
+            items = self.pop_many(1)
+            self.forget(*items)
+            return items[0] if items else None
+
+        while True:
+            # Wake up every reap_interval seconds so an idle consumer still redelivers expired items
+            item = self._db.brpoplpush(self.key, self.processing_key, timeout=timeout or self.reap_interval)
+            if item is not None:
+                self.lease_script(keys=[self.leases_key, self.deliveries_key], args=[item, self.visibility_timeout * 1000])
+                self.forget(item)
+                return item
+            if timeout is not None:
+                return None
+            self.reap_if_due()
+
+    def get_many(self, size, block=True, timeout=None):
+        self.reap_if_due()
+        return super(ReliableQueue, self).get_many(size, block, timeout)
+
+    def pop_many(self, size):
+        return self.pop_script(keys=[self.key, self.processing_key, self.leases_key, self.deliveries_key], args=[size, self.visibility_timeout * 1000])
+
+    def ack(self, *items):
+        """Remove processed items from the processing list. If Redis is unavailable, the items are delivered again later."""
+        if not items:
+            return
+
+        try:
+            pipe = self._db.pipeline()
+            for item in items:
+                pipe.lrem(self.processing_key, 1, item)
+            pipe.zrem(self.leases_key, *items)
+            pipe.hdel(self.deliveries_key, *items)
+            pipe.execute()
+        except redis.RedisError as e:
+            logger.warning(f'{self.key}: Failed to ack {len(items)} items. They will be delivered again. Reason: {e}')
+
+    def release(self, *items):
+        """Put items that were popped but not processed back on the queue, without counting it as a failed delivery."""
+        if not items:
+            return
+
+        pipe = self._db.pipeline()
+        for item in items:
+            pipe.lrem(self.processing_key, 1, item)
+            pipe.hincrby(self.deliveries_key, item, -1)
+        pipe.zrem(self.leases_key, *items)
+        self.requeue(pipe, items)
+        pipe.execute()
+
+    def reap(self):
+        """Requeue items whose lease expired, or move them to the dead letter list. Returns (requeued, dead)."""
+        # The dedupe keys are computed here; the script checks again that each lease has expired
+        args = [self.max_deliveries, self.visibility_timeout * 1000, DEAD_LETTER_SIZE]
+        for item in self._db.zrangebyscore(self.leases_key, '-inf', int(time() * 1000)):
+            args.extend([item, self.get_dedupe_key(item) if self.dedupe_fields else ''])
+
+        requeued, dead = self.reap_script(
+            keys=[self.key, self.processing_key, self.leases_key, self.deliveries_key, self.dead_key, self.pending_key],
+            args=args
+        )
+        if requeued or dead:
+            logger.warning(f'{self.key}: {requeued} expired items requeued, {dead} moved to {self.dead_key}')
+        return requeued, dead
+
+    def reap_if_due(self):
+        if time() - self.last_reaped < self.reap_interval:
+            return
+        self.last_reaped = time()
+        try:
+            self.reap()
+        except redis.RedisError as e:
+            logger.warning(f'{self.key}: Failed to requeue expired items. Reason: {e}')
+
+class RedisPriorityQueue(RedisQueue):
+    """
+    Queue served lowest score first, from a sorted set (queue:<name>:priority) popped with ZPOPMIN and BZPOPMIN.
+    Each job is waiting at most once; its payload is kept in queue:<name>:items and replaced when the job is queued again.
+    Items are removed when they are popped, like RedisQueue. Acking an item records when its job last completed
+    in queue:<name>:done, which the publishers use to decide when the job is due again (see app/destiny/refresh.py).
+    """
+    def __init__(self, name, namespace='queue'):
+        super(RedisPriorityQueue, self).__init__(name, namespace)
+        self.key = f'{self.key}:priority'
+        self.items_key = f'{namespace}:{name}:items'
+        self.done_key = f'{namespace}:{name}:done'
+        self.priority_enqueue_script = self._db.register_script(PRIORITY_ENQUEUE_SCRIPT)
+        self.priority_pop_script = self._db.register_script(PRIORITY_POP_SCRIPT)
+        self.priority_take_script = self._db.register_script(PRIORITY_TAKE_SCRIPT)
+
+    def qsize(self):
+        """Return the approximate size of the queue."""
+        return self._db.zcard(self.key)
+
+    def put(self, item, score=0):
+        """Put item into the queue."""
+        return self.put_many([item], scores=[score])
+
+    def put_many(self, items, chunk_size=1000, scores=None):
+        """Put items into the queue with their scores (0 if scores is None), lower scores first. Returns the number of jobs added."""
+        if not items:
+            return 0
+
+        scores = scores or [0] * len(items)
+        added = 0
+        for i in range(0, len(items), chunk_size):
+            args = []
+            for item, score in zip(items[i:i + chunk_size], scores[i:i + chunk_size]):
+                args.extend([self.get_dedupe_key(item) if self.dedupe_fields else item, score, item])
+            added = added + self.priority_enqueue_script(keys=[self.key, self.items_key], args=args)
+        return added
+
+    def get(self, block=True, timeout=None):
+        """Remove and return the item with the lowest score.
+
+        If optional args block is true and timeout is None (the default), block
+        if necessary until an item is available."""
+        if not block:
+            items = self.pop_many(1)
+            return items[0] if items else None
+
+        while True:
+            popped = self._db.bzpopmin(self.key, timeout=timeout or 0)
+            if not popped:
+                return None
+
+            item = self.priority_take_script(keys=[self.key, self.items_key], args=[popped[1]])
+            # The payload is missing if the job was queued again and another consumer already took it
+            if item is not None:
+                return item
+
+    def pop_many(self, size):
+        return self.priority_pop_script(keys=[self.key, self.items_key], args=[size])
+
+    def forget(self, *items):
+        """Jobs leave the sorted set when they are popped, so there is no dedupe key to remove."""
+        pass
+
+    def release(self, *items):
+        """Put items that were popped but not processed back on the queue."""
+        self.put_many(list(items))
+
+    def ack(self, *items):
+        """Record that the jobs of processed items completed now."""
+        if not items:
+            return
+
+        try:
+            self._db.hmset(self.done_key, {self.get_dedupe_key(item) if self.dedupe_fields else item: time() for item in items})
+        except redis.RedisError as e:
+            logger.warning(f'{self.key}: Failed to record {len(items)} completed jobs. They will be queued again on the next run. Reason: {e}')
+
+    def get_done(self, keys):
+        """Returns the time each job (by dedupe key) last completed, or None for jobs that never completed."""
+        return self._db.hmget(self.done_key, keys)
+
+def create_queue(queue_name):
+    if queue_name in Config.PRIORITY_QUEUES:
+        return RedisPriorityQueue(queue_name)
+    if queue_name in Config.RELIABLE_QUEUES:
+        return ReliableQueue(queue_name)
+    return RedisQueue(queue_name)
+
 def get_redis_queue(queue_name):
+    """
+    Connect to a queue, waiting for Redis if needed.
+    Queues listed in Config.PRIORITY_QUEUES are RedisPriorityQueues and queues listed in Config.RELIABLE_QUEUES are ReliableQueues.
+    """
     while True:
         try:
-            q = RedisQueue(queue_name)
+            q = create_queue(queue_name)
             q.ping()
             return q
         except Exception:
             logger.warning('Failed to connect to Redis. Retrying in 30 seconds.')
             sleep(30)
             pass
+
+def drain(q, size, flush_interval):
+    """
+    Block until one item is available, then keep taking items until there are size items
+    or flush_interval milliseconds have passed since the first one.
+    """
+    items = q.get_many(size)
+    deadline = time() + flush_interval / 1000
+    while len(items) < size:
+        remaining = deadline - time()
+        if remaining <= 0:
+            break
+
+        new_items = q.get_many(size - len(items), block=False)
+        if not new_items:
+            # BLPOP only takes whole seconds, so poll until the deadline instead
+            sleep(min(remaining, 0.05))
+            continue
+        items.extend(new_items)
+    return items
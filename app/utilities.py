@@ -8,28 +8,83 @@ import re
 import sys
 from sqlalchemy.dialects import postgresql
 from config import Config
+from app.redis.rate_limiter import THROTTLE_ERROR_CODES, get_rate_limiter, get_throttle_seconds
 from app.utils import log
 
 logger = log.get_logger(__name__)
 
-def requests_retry_session(retries=2, backoff_factor=1, status_forcelist=(502, 503, 504), session=None):
+THROTTLE_RETRIES = 3
+
+_session = None
+
+def requests_retry_session(retries=2, backoff_factor=1, status_forcelist=(502, 503, 504), session=None, pool_connections=10, pool_maxsize=10):
     # Until a better method can be found, we won't retry on 500 error codes because sometimes these codes are intentionally returned by the API
     session = session or requests.Session()
     retry = Retry(total=retries, read=retries, connect=retries, backoff_factor=backoff_factor, status_forcelist=status_forcelist)
-    adapter = HTTPAdapter(max_retries=retry)
+    adapter = HTTPAdapter(max_retries=retry, pool_connections=pool_connections, pool_maxsize=pool_maxsize)
     session.mount('http://', adapter)
     session.mount('https://', adapter)
     session.headers.update(Config.BUNGIE_API_KEY)
     return session
 
+def get_session():
+    """
+    Return the process-wide pooled session used for every Bungie API request.
+    Connections are kept alive between requests, so repeated calls to bungie.net reuse the same TLS connection.
+    """
+    global _session
+    if _session is None:
+        _session = requests_retry_session(pool_connections=Config.HTTP_POOL_CONNECTIONS, pool_maxsize=Config.HTTP_POOL_MAXSIZE)
+    return _session
+
+def get_http_stats():
+    """
+    Returns connection reuse stats for each host in the pooled session.
+    'requests' is the number of requests sent and 'connections' the number of connections opened to the host.
+    """
+    stats = {}
+    if _session is None:
+        return stats
+
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools[key]
+            stats[f'{pool.scheme}://{pool.host}'] = {
+                'requests': pool.num_requests,
+                'connections': pool.num_connections,
+                'reused': pool.num_requests - pool.num_connections
+            }
+
+    return stats
+
+def log_http_stats():
+    for host, stats in get_http_stats().items():
+        logger.info(f'{host}: {stats["requests"]} requests over {stats["connections"]} connections ({stats["reused"]} reused)')
+
 def http_get(url):
-    try:
-        request = requests_retry_session().get(url)
-    except Exception as e:
-        logger.warning(e)
-        return
+    rate_limiter = get_rate_limiter()
+    for attempt in range(THROTTLE_RETRIES + 1):
+        rate_limiter.acquire()
+        try:
+            request = get_session().get(url)
+        except Exception as e:
+            logger.warning(e)
+            return
+
+        data = json.loads(request.text)
+
+        # Pause every worker for as long as the API asks, then retry requests that were rejected because of throttling
+        throttle_seconds = get_throttle_seconds(data)
+        if not throttle_seconds:
+            break
+
+        rate_limiter.throttle(throttle_seconds)
+        if data.get('ErrorCode') not in THROTTLE_ERROR_CODES or attempt == THROTTLE_RETRIES:
+            break
+
+        logger.warning(f'Throttled while fetching {url}. Retrying in {throttle_seconds} seconds.')
 
-    data = json.loads(request.text)
     if 'ErrorCode' in data:
         if data['ErrorCode'] == 1665:
             logger.debug(f'Private profile {request.request.url} - Response: {data}')
@@ -61,4 +116,4 @@ def save_file(data, filename, path=False):
             print(f'Data saved to file: {filename}.json')
 
 def print_json(data):
-    print(json.dumps(data, indent=4))
\ No newline at end of file
+    print(json.dumps(data, indent=4))
\ No newline at end of file
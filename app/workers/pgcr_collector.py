@@ -1,3 +1,5 @@
+import argparse
+import asyncio
 import json
 import os
 import sys
@@ -5,29 +7,57 @@ import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from app import create_app
+from app import utilities
+from app.async_utilities import AsyncClient
 from app.destiny.client import DestinyAPI
 from app.redis import redis_queue
 from app.utils import log
+from config import Config
+
+HTTP_STATS_INTERVAL = 100
+
+def enqueue_matches(q_matches, data):
+    """Send the new matches found for a player to the matches queue. Returns the (possibly reconnected) queue."""
+    membership_id = data['membershipId']
+    platform = data['membershipType']
+    mode = data['mode']
+    matches = []
+    for character in data['characters']:
+        for pgcr in character['matches']:
+            matches.append(json.dumps({
+                'membershipId': membership_id,
+                'membershipType': platform,
+                'characterId': character['characterId'],
+                'mode': mode,
+                'match': pgcr
+            }))
+
+    try:
+        q_matches.put_many(matches)
+    except Exception as e:
+        logger.warning(f'{membership_id}:{platform}:{mode} Failed to connect to Redis while executing PUT command. Reconnecting. Reason: {e}')
+        q_matches = redis_queue.get_redis_queue(queue_matches)
+        q_matches.put_many(matches)
+
+    return q_matches
 
 def main():
-    queue_players = 'pgcr_players'
-    queue_matches = 'pgcr_matches'
     q_players = redis_queue.get_redis_queue(queue_players)
     q_matches = redis_queue.get_redis_queue(queue_matches)
 
+    processed = 0
     while True:
         try:
             if q_players.empty():
                 exit
 
-            player = q_players.get()
+            item = q_players.get()
         except Exception as e:
             logger.warning(f'Failed to connect to Redis while executing BLPOP command. Reconnecting. Reason: {e}')
             q_players = redis_queue.get_redis_queue(queue_players)
             continue
 
-        player = player.decode('utf-8')
-        player = json.loads(player)
+        player = json.loads(item.decode('utf-8'))
         membership_id = player['membershipId']
         platform = player['membershipType']
         mode = player['mode']
@@ -38,28 +68,54 @@ def main():
             logger.warning(f'{membership_id}:{platform}:{mode} Failed to retrieve check for new PGCRs. Reason: {e}')
             continue
 
-        if data:
-            if data['characters']:
-                for character in data['characters']:
-                    for pgcr in character['matches']:
-                        match = {
-                            'membershipId': membership_id,
-                            'membershipType': platform,
-                            'characterId': character['characterId'],
-                            'mode': mode,
-                            'match': pgcr
-                        }
-
-                        try:
-                            q_matches.put(json.dumps(match))
-                        except Exception as e:
-                            logger.warning(f'{membership_id}:{platform}:{mode} Failed to connect to Redis while executing PUT command. Reconnecting. Reason: {e}')
-                            q_matches = redis_queue.get_redis_queue(queue_matches)
-                            continue
+        processed = processed + 1
+        if processed % HTTP_STATS_INTERVAL == 0:
+            utilities.log_http_stats()
+
+        if data and data['characters']:
+            q_matches = enqueue_matches(q_matches, data)
+        q_players.ack(item)
+
+async def main_async():
+    """Check several players for new matches at once, with all their activity history requests in flight together."""
+    q_players = redis_queue.get_redis_queue(queue_players)
+    q_matches = redis_queue.get_redis_queue(queue_matches)
+    loop = asyncio.get_event_loop()
+
+    async with AsyncClient() as client:
+        while True:
+            try:
+                raw_players = await loop.run_in_executor(None, q_players.get_many, Config.ASYNC_BATCH_SIZE)
+            except Exception as e:
+                logger.warning(f'Failed to connect to Redis while executing BLPOP command. Reconnecting. Reason: {e}')
+                q_players = redis_queue.get_redis_queue(queue_players)
+                continue
+
+            players = [json.loads(player.decode('utf-8')) for player in raw_players]
+            requests = [d2.get_new_matches_async(client, player['membershipId'], player['membershipType'], player['mode']) for player in players]
+            results = await asyncio.gather(*requests, return_exceptions=True)
+
+            for raw_player, player, data in zip(raw_players, players, results):
+                if isinstance(data, Exception):
+                    logger.warning(f'{player["membershipId"]}:{player["membershipType"]}:{player["mode"]} Failed to retrieve check for new PGCRs. Reason: {data}')
+                    continue
+
+                if data and data['characters']:
+                    q_matches = enqueue_matches(q_matches, data)
+                q_players.ack(raw_player)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--async', dest='use_async', action='store_true', help='Check several players concurrently using the async client')
+    args = parser.parse_args()
+
     logger = log.get_logger(__name__)
+    queue_players = 'pgcr_players'
+    queue_matches = 'pgcr_matches'
     app = create_app()
     app.app_context().push()
     d2 = DestinyAPI()
-    main()
\ No newline at end of file
+    if args.use_async:
+        asyncio.get_event_loop().run_until_complete(main_async())
+    else:
+        main()
@@ -1,45 +1,189 @@
+import argparse
+import asyncio
 import json
 import os
 import sys
+from time import time
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from app import create_app
+from app import utilities
+from app.async_utilities import AsyncClient
+from app.destiny import pgcr as pgcr_store
 from app.destiny.client import DestinyAPI
 from app.redis import redis_queue
 from app.utils import log
+from config import Config
+
+HTTP_STATS_INTERVAL = 100
 
 def main():
-    queue = 'pgcr_matches'
     q = redis_queue.get_redis_queue(queue)
+    processed = 0
     while True:
         try:
             if q.empty():
                 exit
 
-            data = q.get()
+            item = q.get()
         except Exception as e:
             logger.warning(f'Failed to connect to Redis while executing BLPOP. Reconnecting. Reason: {e}')
             q = redis_queue.get_redis_queue(queue)
             continue
 
-        logger.debug(f'Data pulled from redis: {data}')
-        data = data.decode('utf-8')
-        data = json.loads(data)
+        logger.debug(f'Data pulled from redis: {item}')
+        data = json.loads(item.decode('utf-8'))
         player = data['membershipId']
         platform = data['membershipType']
         character = data['characterId']
         mode = data['mode']
         match = data['match']
 
+        # Matches that were not stored are left unacked, so they are delivered again
         try:
-            d2.db_store_pgcr(player, character, match, mode)
+            if d2.db_store_pgcr(player, character, match, mode):
+                q.ack(item)
         except Exception as e:
-            logger.warning(f'{player}:{platform}:{character_id}:{mode} Error storing PGCR {match}. Reason: {e}')
+            logger.warning(f'{player}:{platform}:{character}:{mode} Error storing PGCR {match}. Reason: {e}')
+
+        processed = processed + 1
+        if processed % HTTP_STATS_INTERVAL == 0:
+            utilities.log_http_stats()
+
+async def main_async():
+    """Fetch several PGCRs at once. Each PGCR is stored as soon as its request completes."""
+    q = redis_queue.get_redis_queue(queue)
+    loop = asyncio.get_event_loop()
+
+    async with AsyncClient() as client:
+        while True:
+            try:
+                raw_items = await loop.run_in_executor(None, q.get_many, Config.ASYNC_BATCH_SIZE)
+            except Exception as e:
+                logger.warning(f'Failed to connect to Redis while executing BLPOP. Reconnecting. Reason: {e}')
+                q = redis_queue.get_redis_queue(queue)
+                continue
+
+            items = [json.loads(item.decode('utf-8')) for item in raw_items]
+            requests = [d2.db_store_pgcr_async(client, item['membershipId'], item['characterId'], item['match'], item['mode']) for item in items]
+            results = await asyncio.gather(*requests, return_exceptions=True)
+
+            processed = []
+            for raw_item, item, result in zip(raw_items, items, results):
+                if isinstance(result, Exception):
+                    logger.warning(f'{item["membershipId"]}:{item["membershipType"]}:{item["characterId"]}:{item["mode"]} Error storing PGCR {item["match"]}. Reason: {result}')
+                    continue
+                if result:
+                    processed.append(raw_item)
+            q.ack(*processed)
+
+class BatchStats(object):
+    """Throughput and latency counters for batch mode."""
+    def __init__(self):
+        self.started = time()
+        self.batches = 0
+        self.items = 0
+        self.stored = 0
+        self.fetch_time = 0
+        self.write_time = 0
+
+    def add(self, items, stored, fetch_time, write_time):
+        self.batches = self.batches + 1
+        self.items = self.items + items
+        self.stored = self.stored + stored
+        self.fetch_time = self.fetch_time + fetch_time
+        self.write_time = self.write_time + write_time
+
+    def log(self):
+        elapsed = time() - self.started
+        logger.info(
+            f'{self.batches} batches, {self.stored}/{self.items} PGCRs stored, {self.stored / elapsed:.1f} PGCRs/sec. '
+            f'Average batch: {self.items / self.batches:.1f} items, fetch {self.fetch_time / self.batches * 1000:.0f}ms, '
+            f'write {self.write_time / self.batches * 1000:.0f}ms'
+        )
+
+async def main_batch():
+    """
+    Drain up to PGCR_BATCH_SIZE matches (or whatever arrives within PGCR_FLUSH_INTERVAL ms), fetch their PGCRs
+    concurrently and store them all in one transaction.
+    """
+    q = redis_queue.get_redis_queue(queue)
+    loop = asyncio.get_event_loop()
+    stats = BatchStats()
+
+    async with AsyncClient() as client:
+        while True:
+            try:
+                raw_items = await loop.run_in_executor(None, redis_queue.drain, q, Config.PGCR_BATCH_SIZE, Config.PGCR_FLUSH_INTERVAL)
+            except Exception as e:
+                logger.warning(f'Failed to connect to Redis while executing BLPOP. Reconnecting. Reason: {e}')
+                q = redis_queue.get_redis_queue(queue)
+                continue
+
+            batch = [(raw_item, json.loads(raw_item.decode('utf-8'))) for raw_item in raw_items]
+
+            # Only download PGCRs that are not stored yet and that no other consumer is downloading.
+            # Matches claimed by another consumer go back on the queue and are linked once that consumer has stored them.
+            matches = set(str(item['match']) for _, item in batch)
+            stored_matches = pgcr_store.get_stored(matches)
+            claimed = [match for match in matches if match not in stored_matches and pgcr_store.claim(match)]
+            deferred = [raw_item for raw_item, item in batch if str(item['match']) not in stored_matches and str(item['match']) not in claimed]
+            q.release(*deferred)
+            batch = [(raw_item, item) for raw_item, item in batch if raw_item not in deferred]
+            items = [item for _, item in batch]
+            if not items:
+                await asyncio.sleep(0.5)
+                continue
+
+            fetch_start = time()
+            pgcrs = await asyncio.gather(*[d2.get_pgcr_async(client, match) for match in claimed], return_exceptions=True)
+            fetch_time = time() - fetch_start
+
+            fetched = {}
+            for match, pgcr in zip(claimed, pgcrs):
+                if isinstance(pgcr, Exception) or not pgcr:
+                    logger.warning(f'Failed to retrieve PGCR {match}. Reason: {pgcr}')
+                    continue
+                fetched[match] = pgcr
+
+            reports = [{'player': item['membershipId'], 'character_id': item['characterId'], 'match': item['match'], 'mode': item['mode'], 'pgcr': fetched.get(str(item['match']))} for item in items]
+
+            write_start = time()
+            try:
+                stored = d2.db_add_pgcrs(reports)
+            except Exception as e:
+                logger.warning(f'Error storing a batch of {len(reports)} PGCRs. Reason: {e}')
+                stored = None
+            finally:
+                for match in claimed:
+                    pgcr_store.release(match)
+            write_time = time() - write_start
+
+            # Matches whose PGCR could not be downloaded are left unacked, so they are delivered again
+            if stored is not None:
+                q.ack(*[raw_item for raw_item, item in batch if str(item['match']) in stored_matches or str(item['match']) in fetched])
+            stored = stored or 0
+
+            stats.add(len(items), stored, fetch_time, write_time)
+            stats.log()
+            if stats.batches % HTTP_STATS_INTERVAL == 0:
+                utilities.log_http_stats()
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--async', dest='use_async', action='store_true', help='Fetch several PGCRs concurrently using the async client')
+    parser.add_argument('--batch', action='store_true', help='Store PGCRs in batches of up to PGCR_BATCH_SIZE per transaction')
+    args = parser.parse_args()
+
     logger = log.get_logger(__name__)
+    queue = 'pgcr_matches'
     app = create_app()
     app.app_context().push()
     d2 = DestinyAPI()
-    main()
+    if args.batch:
+        asyncio.get_event_loop().run_until_complete(main_batch())
+    elif args.use_async:
+        asyncio.get_event_loop().run_until_complete(main_async())
+    else:
+        main()
@@ -9,20 +9,23 @@ from app.destiny.client import DestinyAPI
 from app.redis import redis_queue
 from app.utils import log
 
-def main():
+logger = log.get_logger(__name__)
+
+def publish(d2):
+    """Queue every clan member in the database for a crucible stats update. Returns the number of players added to the queue."""
     q = redis_queue.get_redis_queue('players')
     clan_members = d2.db_get_clan_members()
-    for clan_member in clan_members:
-        try:
-            q.put(json.dumps({'membershipId': clan_member.membership_id, 'membershipType': clan_member.membership_type}))
-        except Exception:
-            logger.warning('Failed to connect to issue Redis command. Reconnecting.')
-            q = redis_queue.get_redis_queue('players')
-            continue
+    items = [json.dumps({'membershipId': clan_member.membership_id, 'membershipType': clan_member.membership_type}) for clan_member in clan_members]
+    try:
+        added = q.put_many(items)
+    except Exception:
+        logger.warning('Failed to connect to issue Redis command. Reconnecting.')
+        q = redis_queue.get_redis_queue('players')
+        added = q.put_many(items)
+    logger.info(f'Sent {added} players to Redis queue players. {len(items) - added} were already queued.')
+    return added
 
 if __name__ == "__main__":
-    logger = log.get_logger(__name__)
     app = create_app()
     app.app_context().push()
-    d2 = DestinyAPI()
-    main()
+    publish(DestinyAPI())
@@ -1,34 +1,41 @@
-import json
 import os
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from app import create_app
+from app.destiny import refresh
 from app.destiny.client import DestinyAPI
 from app.redis import redis_queue
 from app.utils import log
 
-def main():
+logger = log.get_logger(__name__)
+
+def publish(d2, clan_members=None):
+    """
+    Queue the clan members that are due for a check for new raid and crucible matches. Returns the number of jobs queued.
+    clan_members is the output of DestinyAPI.get_clan_members_api(), which is called if it is not given.
+    """
     queue = 'pgcr_players'
     modes = [4, 5]
     q = redis_queue.get_redis_queue(queue)
 
-    clan_members = d2.get_clan_members_api()
+    clan_members = clan_members if clan_members is not None else d2.get_clan_members_api()
+    items = []
     for mode in modes:
         for clan_member in clan_members:
-            clan_member['mode'] = mode
-            try:
-                q.put(json.dumps(clan_member))
-                logger.debug(f'Sending data to Redis queue {queue}: {clan_member}')
-            except Exception:
-                logger.warning('Failed to connect to Redis while executing PUT request. Reconnecting.')
-                q = redis_queue.get_redis_queue(queue)
-                continue
+            items.append(dict(clan_member, mode=mode))
+
+    try:
+        due = refresh.schedule(q, items)
+    except Exception:
+        logger.warning('Failed to connect to Redis while executing PUT request. Reconnecting.')
+        q = redis_queue.get_redis_queue(queue)
+        due = refresh.schedule(q, items)
+    logger.info(f'Sent {due} of {len(items)} players to Redis queue {queue}. The others are not due for a refresh.')
+    return due
 
 if __name__ == "__main__":
-    logger = log.get_logger(__name__)
     app = create_app()
     app.app_context().push()
-    d2 = DestinyAPI()
-    main()
+    publish(DestinyAPI())
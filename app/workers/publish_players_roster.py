@@ -1,29 +1,34 @@
-import json
 import os
 import sys
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from app import create_app
+from app.destiny import refresh
 from app.destiny.client import DestinyAPI
 from app.redis import redis_queue
 from app.utils import log
 
-def main():
+logger = log.get_logger(__name__)
+
+def publish(d2, clan_members=None):
+    """
+    Queue the clan members that are due for a stats refresh. Returns the number of players queued.
+    clan_members is the output of DestinyAPI.get_clan_members_api(), which is called if it is not given.
+    """
     q = redis_queue.get_redis_queue('playerstats')
 
-    clan_members = d2.get_clan_members_api()
-    for clan_member in clan_members:
-        try:
-            q.put(json.dumps(clan_member))
-        except Exception:
-            logger.warning('Failed to connect to issue Redis command. Reconnecting.')
-            q = redis_queue.get_redis_queue('playerstats')
-            continue
+    clan_members = clan_members if clan_members is not None else d2.get_clan_members_api()
+    try:
+        due = refresh.schedule(q, clan_members)
+    except Exception:
+        logger.warning('Failed to connect to issue Redis command. Reconnecting.')
+        q = redis_queue.get_redis_queue('playerstats')
+        due = refresh.schedule(q, clan_members)
+    logger.info(f'Sent {due} of {len(clan_members)} players to Redis queue playerstats. The others are not due for a refresh.')
+    return due
 
 if __name__ == "__main__":
-    logger = log.get_logger(__name__)
     app = create_app()
     app.app_context().push()
-    d2 = DestinyAPI()
-    main()
+    publish(DestinyAPI())
@@ -1,30 +1,59 @@
 import json
+import math
 import os
 import sys
+from time import time
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from app import create_app
+from app import utilities
+from app.destiny import cache
+from app.destiny import definitions
+from app.destiny import snapshot
 from app.destiny.client import DestinyAPI
 from app.redis import redis_queue
 from app.utils import log
+from config import Config
+
+HTTP_STATS_INTERVAL = 100
 
 def main():
     q = redis_queue.get_redis_queue('playerstats')
+    processed = 0
+    last_published = 0
+    unpublished = 0
     while True:
+        # Rebuild the roster snapshot with the players updated since the last one, at most every SNAPSHOT_INTERVAL seconds
+        if unpublished and time() - last_published >= Config.SNAPSHOT_INTERVAL:
+            try:
+                if snapshot.publish_roster(d2.api_get_roster()):
+                    # Only now, so responses cached in between are not stored under the new generation
+                    cache.invalidate('roster', 'players')
+                    unpublished = 0
+                cache.flush()
+            except Exception:
+                logger.exception('Failed to build the roster snapshot')
+            # A failed rebuild is retried on the next interval, not after every player
+            last_published = time()
+
         if q.empty():
             logger.debug('Playerstats queue is empty')
             exit
 
         try:
-            player = q.get()
+            # While updates are waiting to be published, only block until the snapshot is due
+            timeout = max(1, math.ceil(Config.SNAPSHOT_INTERVAL - (time() - last_published))) if unpublished else None
+            item = q.get(timeout=timeout)
         except Exception:
             logger.exception('Failed to connect to issue Redis command. Reconnecting.')
             q = redis_queue.get_redis_queue('playerstats')
             continue
 
-        player = player.decode('utf-8')
-        player = json.loads(player)
+        if item is None:
+            continue
+
+        player = json.loads(item.decode('utf-8'))
         membership_id = player['membershipId']
         platform = player['membershipType']
         status = player['isOnline']
@@ -33,6 +62,14 @@ def main():
             d2.db_update_stats(membership_id, platform, status)
         except Exception:
             logger.exception(f'Failed to update player {membership_id}. Platform: {platform} | Online: {status}')
+        else:
+            q.ack(item)
+            unpublished = unpublished + 1
+
+        processed = processed + 1
+        if processed % HTTP_STATS_INTERVAL == 0:
+            utilities.log_http_stats()
+            logger.info(f'Definition cache: {definitions.cache.stats()}')
 
 if __name__ == "__main__":
     logger = log.get_logger(__name__)
@@ -0,0 +1,106 @@
+import os
+import random
+import sys
+from time import sleep, time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app import create_app
+from app import models
+from app.destiny import cache
+from app.destiny import manifest
+from app.destiny.client import DestinyAPI
+from app.workers import publish_players_crucible
+from app.workers import publish_players_pgcr
+from app.workers import publish_players_roster
+from app.utils import log
+from config import Config
+
+logger = log.get_logger(__name__)
+
+class ClanMembers(object):
+    """The clan member list from Bungie, shared by the jobs that run within ttl seconds of each other."""
+    def __init__(self, d2, ttl):
+        self.d2 = d2
+        self.ttl = ttl
+        self.members = None
+        self.updated = 0
+
+    def get(self):
+        if self.members is None or time() - self.updated >= self.ttl:
+            try:
+                self.members = self.d2.get_clan_members_api()
+                self.updated = time()
+            except Exception as e:
+                if self.members is None:
+                    raise
+                logger.warning(f'Failed to refresh the clan member list, reusing the one from {time() - self.updated:.0f}s ago. Reason: {e}')
+        return self.members
+
+class Job(object):
+    """
+    A function that runs every interval seconds, plus a random delay of up to jitter * interval seconds.
+    Runs are planned on a fixed grid so they do not drift. If a run is missed because an earlier job took too long,
+    it is skipped rather than run late, so a slow job never causes a burst of catch-up runs.
+    """
+    def __init__(self, name, func, interval, jitter):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.planned = time()
+        self.next_run = self.planned + self.get_jitter()
+
+    def get_jitter(self):
+        return random.uniform(0, self.interval * self.jitter)
+
+    def run(self):
+        start = time()
+        try:
+            self.func()
+            logger.info(f'{self.name}: finished in {time() - start:.1f}s')
+        except Exception:
+            logger.exception(f'{self.name}: failed after {time() - start:.1f}s')
+            models.db.session.rollback()
+        finally:
+            # Do not hold a connection (or an open transaction) while waiting for the next run
+            models.db.session.remove()
+            cache.flush()
+        self.schedule()
+
+    def schedule(self):
+        now = time()
+        self.planned = self.planned + self.interval
+        if self.planned <= now:
+            missed = int((now - self.planned) // self.interval) + 1
+            logger.warning(f'{self.name}: skipping {missed} missed runs')
+            self.planned = self.planned + missed * self.interval
+        self.next_run = self.planned + self.get_jitter()
+
+def get_jobs(d2, clan_members):
+    jobs = {
+        'roster': lambda: publish_players_roster.publish(d2, clan_members.get()),
+        'pgcr': lambda: publish_players_pgcr.publish(d2, clan_members.get()),
+        'crucible': lambda: publish_players_crucible.publish(d2),
+        'collectibles': d2.get_collectible_exotic_weapons,
+        'manifest': manifest.update
+    }
+    return [Job(name, jobs[name], interval, Config.SCHEDULER_JITTER) for name, interval in Config.SCHEDULER_INTERVALS.items()]
+
+def main():
+    d2 = DestinyAPI()
+    clan_members = ClanMembers(d2, Config.SCHEDULER_ROSTER_TTL)
+    jobs = get_jobs(d2, clan_members)
+    logger.info(f'Scheduling {", ".join(f"{job.name} every {job.interval}s" for job in jobs)}')
+
+    while True:
+        job = min(jobs, key=lambda job: job.next_run)
+        wait = job.next_run - time()
+        if wait > 0:
+            sleep(wait)
+        job.run()
+
+if __name__ == "__main__":
+    app = create_app()
+    app.app_context().push()
+    main()
@@ -0,0 +1,103 @@
+"""
+Query plans and latency for the API endpoints in app/destiny/resources.py.
+Run it before and after a migration to compare:
+
+    python benchmark.py > before.txt
+    alembic upgrade head
+    python benchmark.py > after.txt
+"""
+import argparse
+from statistics import median
+from time import time
+from sqlalchemy import text
+from app import create_app
+from app import models
+
+# The queries behind the busiest endpoints, with the parameters filled in from the sample data below
+QUERIES = {
+    'player by membership_id': 'SELECT * FROM player WHERE membership_id = :membership_id',
+    'character by char_id': 'SELECT * FROM "character" WHERE char_id = :char_id',
+    'player weapon kills (30 days)': """
+        SELECT weapon.name, weapon.weapon_id, SUM(weapondata.kills) AS total_kills
+        FROM weapon JOIN weapondata ON weapon.id = weapondata.parent_weapon
+        JOIN "character" ON "character".id = weapondata.parent_id
+        JOIN player ON player.id = "character".parent_id
+        WHERE player.membership_id = :membership_id AND weapondata.match_time >= now() - interval '30 days'
+        GROUP BY weapon.name, weapon.weapon_id ORDER BY total_kills DESC
+    """,
+    'weapon kills by player (30 days)': """
+        SELECT player.name, SUM(weapondata.kills) AS total_kills
+        FROM weapondata JOIN weapon ON weapon.id = weapondata.parent_weapon
+        JOIN "character" ON "character".id = weapondata.parent_id
+        JOIN player ON player.id = "character".parent_id
+        WHERE weapon.weapon_id = :weapon_id AND weapondata.match_time >= now() - interval '30 days'
+        GROUP BY player.name ORDER BY total_kills DESC
+    """,
+    'item definition by hash': 'SELECT json FROM "DestinyInventoryItemDefinition" WHERE hash = :weapon_id',
+    'collectible by hash': 'SELECT * FROM collectibles_game WHERE collectible_hash = :collectible_hash',
+    'last pgcr by mode': """
+        SELECT pgcr.pgcr_id FROM pgcr JOIN pgcr_participant ON pgcr.id = pgcr_participant.pgcr
+        WHERE pgcr_participant.parent_character = :character AND pgcr_participant.mode = 5
+        ORDER BY pgcr_participant.date DESC LIMIT 1
+    """,
+}
+
+ENDPOINTS = [
+    '/api/resources/roster',
+    '/api/resources/player/{membership_id}',
+    '/api/resources/player/{membership_id}/weapons/0',
+    '/api/resources/player/{membership_id}/weapons/30',
+    '/api/resources/player/{membership_id}/characters/30',
+    '/api/resources/weapon/{weapon_id}',
+    '/api/resources/weapon/{weapon_id}/kills/30',
+    '/api/resources/collectible/{collectible_hash}',
+    '/api/resources/collectibles',
+    '/api/resources/weapontypes/all/30',
+    '/api/resources/weapons/Hand%20Cannon/30',
+]
+
+def get_sample():
+    """Ids of an existing player, character, weapon and collectible to query with."""
+    character = models.db.session.query(models.Characters).first()
+    player = models.db.session.query(models.Players).filter(models.Players.id==character.parent_id).first()
+    weapon = models.db.session.query(models.Weapons).first()
+    collectible = models.db.session.query(models.CollectiblesGame).first()
+    return {
+        'membership_id': player.membership_id,
+        'char_id': character.char_id,
+        'character': character.id,
+        'weapon_id': weapon.weapon_id if weapon else '0',
+        'collectible_hash': collectible.collectible_hash if collectible else '0'
+    }
+
+def explain(sample):
+    for name, query in QUERIES.items():
+        rows = models.db.session.execute(text(f'EXPLAIN (ANALYZE, BUFFERS) {query}'), sample).fetchall()
+        plan = [row[0] for row in rows]
+        print(f'\n== {name}')
+        print('\n'.join(plan))
+
+def time_endpoints(app, sample, runs):
+    client = app.test_client()
+    print(f'\n{"endpoint":<60} {"median ms":>10} {"max ms":>10}')
+    for endpoint in ENDPOINTS:
+        url = endpoint.format(**sample)
+        timings = []
+        for _ in range(runs):
+            start = time()
+            response = client.get(url)
+            timings.append((time() - start) * 1000)
+        print(f'{url:<60} {median(timings):>10.1f} {max(timings):>10.1f}  ({response.status_code})')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=20, help='Requests per endpoint')
+    parser.add_argument('--no-explain', dest='explain', action='store_false', help='Skip EXPLAIN ANALYZE')
+    args = parser.parse_args()
+
+    app = create_app()
+    app.app_context().push()
+    sample = get_sample()
+    if args.explain:
+        explain(sample)
+    time_endpoints(app, sample, args.runs)
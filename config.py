@@ -11,6 +11,62 @@ class Config(object):
     DIST_DIR = os.path.join(ROOT_DIR, 'dist')
     PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
     BUNGIE_API_KEY = {'X-API-Key': 'api key here'}
+    HTTP_POOL_CONNECTIONS = 10
+    HTTP_POOL_MAXSIZE = 20
+    ASYNC_CONCURRENCY = 20
+    ASYNC_BATCH_SIZE = 10
+    # pgcr_consumer.py --batch: PGCRs written per transaction and the longest a batch waits to fill up (ms)
+    PGCR_BATCH_SIZE = 100
+    PGCR_FLUSH_INTERVAL = 1000
+    # Seconds a PGCR download is reserved for one consumer, and how long other consumers wait for it to be stored
+    PGCR_INFLIGHT_TTL = 60
+    PGCR_INFLIGHT_WAIT = 10
+    # 'compressed' stores a slimmed, zlib compressed PGCR in pgcr.blob; 'json' stores the full response in pgcr.data
+    PGCR_STORAGE = 'compressed'
+    # Seconds API responses are cached, per endpoint family (see app/destiny/cache.py)
+    RESPONSE_CACHE_TTL = {'info': 60, 'roster': 300, 'players': 300, 'weapons': 600, 'collectibles': 900}
+    RESPONSE_CACHE_LOCAL_SIZE = 1000
+    # Shortest time between invalidations of a family by the workers that update one player or match at a time
+    RESPONSE_CACHE_INVALIDATE_INTERVAL = 30
+    # Cache-Control max-age for API responses, so nginx and browsers can cache them too
+    RESPONSE_CACHE_MAX_AGE = 30
+    # Roster snapshots: seconds between rebuilds by each roster worker, and how long one is served before falling back to the database
+    SNAPSHOT_INTERVAL = 30
+    SNAPSHOT_TTL = 1800
+    # Queues whose items stay in queue:<name>:processing until the consumer acks them (see app/redis/redis_queue.py)
+    RELIABLE_QUEUES = ['pgcr_matches']
+    # Player queues served online players first, then by last played. A job that was lost or failed is queued again on the next run.
+    PRIORITY_QUEUES = ['pgcr_players', 'playerstats']
+    # Seconds a consumer has to ack an item before it is delivered again, deliveries before an item is moved to
+    # queue:<name>:dead, and seconds between checks for expired items
+    QUEUE_VISIBILITY_TIMEOUT = 300
+    QUEUE_MAX_DELIVERIES = 5
+    QUEUE_REAP_INTERVAL = 30
+    # Payload fields that identify a job, per queue. A job is only enqueued once until a consumer pops it, or until
+    # QUEUE_DEDUPE_TTL seconds have passed
+    QUEUE_DEDUPE_KEYS = {'players': ['membershipId'], 'playerstats': ['membershipId'], 'pgcr_players': ['membershipId', 'mode'], 'pgcr_matches': ['characterId', 'match']}
+    QUEUE_DEDUPE_TTL = 3600
+    # Seconds between refreshes of a player on the priority queues: online, played within n seconds, and everyone else
+    REFRESH_INTERVAL_ONLINE = 60
+    REFRESH_INTERVALS = [(86400, 300), (7 * 86400, 1800)]
+    REFRESH_INTERVAL_DORMANT = 6 * 3600
+    # app/workers/scheduler.py: seconds between runs of each job ('crucible' is also available). Jobs that are not listed do not run.
+    SCHEDULER_INTERVALS = {'roster': 60, 'pgcr': 60, 'collectibles': 3600, 'manifest': 3600}
+    # Random delay added to each run, as a fraction of its interval, so jobs with the same interval do not fire together
+    SCHEDULER_JITTER = 0.1
+    # Seconds the clan member list from Bungie is shared between jobs
+    SCHEDULER_ROSTER_TTL = 60
+    # Requests per second shared by every worker (0 disables rate limiting)
+    BUNGIE_RATE_LIMIT = 20
+    BUNGIE_RATE_BURST = 25
+    DEFINITION_CACHE_SIZE = 20000
+    DEFINITION_CACHE_CHECK_INTERVAL = 60
+    # 'postgres' reads the Destiny*Definition tables, 'sqlite' reads the downloaded content database directly
+    DEFINITION_STORE = 'postgres'
+    MANIFEST_DB_PATH = os.path.join(PROJECT_ROOT, 'db.sqlite3')
+    MANIFEST_DIR = os.path.join(PROJECT_ROOT, 'manifests')
+    MANIFEST_SNAPSHOTS_KEEP = 2
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024
 
 class ConfigProd(object):
     db_url = 'postgresql://username:password@db:5432/swampfox'
@@ -20,4 +76,60 @@ class ConfigProd(object):
     ROOT_DIR = os.path.dirname(__file__)
     DIST_DIR = os.path.join(ROOT_DIR, 'dist')
     PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
-    BUNGIE_API_KEY = {'X-API-Key': 'api key here'}
\ No newline at end of file
+    BUNGIE_API_KEY = {'X-API-Key': 'api key here'}
+    HTTP_POOL_CONNECTIONS = 10
+    HTTP_POOL_MAXSIZE = 20
+    ASYNC_CONCURRENCY = 20
+    ASYNC_BATCH_SIZE = 10
+    # pgcr_consumer.py --batch: PGCRs written per transaction and the longest a batch waits to fill up (ms)
+    PGCR_BATCH_SIZE = 100
+    PGCR_FLUSH_INTERVAL = 1000
+    # Seconds a PGCR download is reserved for one consumer, and how long other consumers wait for it to be stored
+    PGCR_INFLIGHT_TTL = 60
+    PGCR_INFLIGHT_WAIT = 10
+    # 'compressed' stores a slimmed, zlib compressed PGCR in pgcr.blob; 'json' stores the full response in pgcr.data
+    PGCR_STORAGE = 'compressed'
+    # Seconds API responses are cached, per endpoint family (see app/destiny/cache.py)
+    RESPONSE_CACHE_TTL = {'info': 60, 'roster': 300, 'players': 300, 'weapons': 600, 'collectibles': 900}
+    RESPONSE_CACHE_LOCAL_SIZE = 1000
+    # Shortest time between invalidations of a family by the workers that update one player or match at a time
+    RESPONSE_CACHE_INVALIDATE_INTERVAL = 30
+    # Cache-Control max-age for API responses, so nginx and browsers can cache them too
+    RESPONSE_CACHE_MAX_AGE = 30
+    # Roster snapshots: seconds between rebuilds by each roster worker, and how long one is served before falling back to the database
+    SNAPSHOT_INTERVAL = 30
+    SNAPSHOT_TTL = 1800
+    # Queues whose items stay in queue:<name>:processing until the consumer acks them (see app/redis/redis_queue.py)
+    RELIABLE_QUEUES = ['pgcr_matches']
+    # Player queues served online players first, then by last played. A job that was lost or failed is queued again on the next run.
+    PRIORITY_QUEUES = ['pgcr_players', 'playerstats']
+    # Seconds a consumer has to ack an item before it is delivered again, deliveries before an item is moved to
+    # queue:<name>:dead, and seconds between checks for expired items
+    QUEUE_VISIBILITY_TIMEOUT = 300
+    QUEUE_MAX_DELIVERIES = 5
+    QUEUE_REAP_INTERVAL = 30
+    # Payload fields that identify a job, per queue. A job is only enqueued once until a consumer pops it, or until
+    # QUEUE_DEDUPE_TTL seconds have passed
+    QUEUE_DEDUPE_KEYS = {'players': ['membershipId'], 'playerstats': ['membershipId'], 'pgcr_players': ['membershipId', 'mode'], 'pgcr_matches': ['characterId', 'match']}
+    QUEUE_DEDUPE_TTL = 3600
+    # Seconds between refreshes of a player on the priority queues: online, played within n seconds, and everyone else
+    REFRESH_INTERVAL_ONLINE = 60
+    REFRESH_INTERVALS = [(86400, 300), (7 * 86400, 1800)]
+    REFRESH_INTERVAL_DORMANT = 6 * 3600
+    # app/workers/scheduler.py: seconds between runs of each job ('crucible' is also available). Jobs that are not listed do not run.
+    SCHEDULER_INTERVALS = {'roster': 60, 'pgcr': 60, 'collectibles': 3600, 'manifest': 3600}
+    # Random delay added to each run, as a fraction of its interval, so jobs with the same interval do not fire together
+    SCHEDULER_JITTER = 0.1
+    # Seconds the clan member list from Bungie is shared between jobs
+    SCHEDULER_ROSTER_TTL = 60
+    # Requests per second shared by every worker (0 disables rate limiting)
+    BUNGIE_RATE_LIMIT = 20
+    BUNGIE_RATE_BURST = 25
+    DEFINITION_CACHE_SIZE = 20000
+    DEFINITION_CACHE_CHECK_INTERVAL = 60
+    # 'postgres' reads the Destiny*Definition tables, 'sqlite' reads the downloaded content database directly
+    DEFINITION_STORE = 'postgres'
+    MANIFEST_DB_PATH = os.path.join(PROJECT_ROOT, 'db.sqlite3')
+    MANIFEST_DIR = os.path.join(PROJECT_ROOT, 'manifests')
+    MANIFEST_SNAPSHOTS_KEEP = 2
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024
\ No newline at end of file
@@ -28,6 +28,9 @@ def add_members():
 def update_collectibles():
     d2.get_collectible_exotic_weapons()
 
+def update_raid_stats():
+    d2.get_raid_stats()
+
 def download_pgcr_history_crucible():
     d2.download_pgcr_history_crucible('4611686018470721488', '2305843009354414197')
 
@@ -39,6 +42,7 @@ function_map = {
     'addmembers': add_members,
     'glory': update_glory,
     'collectibles': update_collectibles,
+    'raids': update_raid_stats,
     'pgcr': download_pgcr_history_crucible
 }
 
@@ -0,0 +1,61 @@
+"""pgcrparticipant
+
+Revision ID: 8827e19b1762
+Revises: 8e7b591804e2
+Create Date: 2026-10-18 11:02:17.604931
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8827e19b1762'
+down_revision = '8e7b591804e2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('pgcr_participant',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('pgcr', sa.Integer(), nullable=True),
+    sa.Column('parent_character', sa.Integer(), nullable=True),
+    sa.Column('mode', sa.Integer(), nullable=True),
+    sa.Column('date', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['parent_character'], ['character.id'], ),
+    sa.ForeignKeyConstraint(['pgcr'], ['pgcr.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('pgcr', 'parent_character', 'mode')
+    )
+    op.create_index(op.f('ix_pgcr_participant_parent_character'), 'pgcr_participant', ['parent_character'], unique=False)
+
+    # Link every character to the first stored copy of each PGCR, then drop the other copies
+    op.execute("""
+        INSERT INTO pgcr_participant (pgcr, parent_character, mode, date)
+        SELECT keep_id, parent_character, mode, date
+        FROM (SELECT parent_character, mode, date, MIN(id) OVER (PARTITION BY pgcr_id) AS keep_id FROM pgcr) AS p
+        WHERE parent_character IS NOT NULL
+        ON CONFLICT DO NOTHING
+    """)
+    op.execute("DELETE FROM pgcr WHERE id NOT IN (SELECT MIN(id) FROM pgcr GROUP BY pgcr_id)")
+
+    op.drop_column('pgcr', 'parent_character')
+    op.drop_column('pgcr', 'mode')
+    op.create_unique_constraint('pgcr_pgcr_id_key', 'pgcr', ['pgcr_id'])
+
+
+def downgrade():
+    op.drop_constraint('pgcr_pgcr_id_key', 'pgcr', type_='unique')
+    op.add_column('pgcr', sa.Column('mode', sa.Integer(), nullable=True))
+    op.add_column('pgcr', sa.Column('parent_character', sa.Integer(), nullable=True))
+    op.create_foreign_key('pgcr_parent_character_fkey', 'pgcr', 'character', ['parent_character'], ['id'])
+
+    # Only one participant per PGCR can be restored
+    op.execute("""
+        UPDATE pgcr SET parent_character = p.parent_character, mode = p.mode
+        FROM (SELECT DISTINCT ON (pgcr) pgcr, parent_character, mode FROM pgcr_participant ORDER BY pgcr, id) AS p
+        WHERE pgcr.id = p.pgcr
+    """)
+    op.drop_index(op.f('ix_pgcr_participant_parent_character'), table_name='pgcr_participant')
+    op.drop_table('pgcr_participant')
@@ -0,0 +1,32 @@
+"""weaponname
+
+Revision ID: 8e7b591804e2
+Revises: 9abb8217a882
+Create Date: 2026-10-18 10:12:41.318202
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e7b591804e2'
+down_revision = '9abb8217a882'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Weapons are deduplicated by name. Point weapon data at the first row for each name and drop the duplicates
+    # so the unique constraint can be created.
+    op.execute("""
+        UPDATE weapondata SET parent_weapon = w.keep_id
+        FROM (SELECT id, MIN(id) OVER (PARTITION BY name) AS keep_id FROM weapon) AS w
+        WHERE weapondata.parent_weapon = w.id AND w.id <> w.keep_id
+    """)
+    op.execute("DELETE FROM weapon WHERE id NOT IN (SELECT MIN(id) FROM weapon GROUP BY name)")
+    op.create_unique_constraint('weapon_name_key', 'weapon', ['name'])
+
+
+def downgrade():
+    op.drop_constraint('weapon_name_key', 'weapon', type_='unique')
@@ -0,0 +1,108 @@
+"""pgcrentry
+
+Revision ID: 8f6dbda6c7e8
+Revises: cd5467a497f7
+Create Date: 2026-10-18 12:31:05.877410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from datetime import datetime
+import json
+import zlib
+
+
+# revision identifiers, used by Alembic.
+revision = '8f6dbda6c7e8'
+down_revision = 'cd5467a497f7'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+
+def get_value(entry, stat):
+    value = entry.get('values', {}).get(stat)
+    return int(value['basic']['value']) if value else None
+
+
+def extract_entries(pgcr, report):
+    # Same as app.destiny.pgcr.extract_entries(), copied so the migration does not depend on the app
+    response = report['Response']
+    details = response['activityDetails']
+    period = datetime.strptime(response['period'], '%Y-%m-%dT%H:%M:%SZ')
+    entries = []
+    for entry in response.get('entries', []):
+        entries.append({
+            'pgcr': pgcr,
+            'character_id': str(entry['characterId']),
+            'membership_id': str(entry['player']['destinyUserInfo']['membershipId']),
+            'team': get_value(entry, 'team'),
+            'standing': entry.get('standing'),
+            'score': int(entry['score']['basic']['value']) if 'score' in entry else None,
+            'kills': get_value(entry, 'kills'),
+            'deaths': get_value(entry, 'deaths'),
+            'completed': get_value(entry, 'completed'),
+            'duration': get_value(entry, 'activityDurationSeconds'),
+            'activity_hash': str(details['directorActivityHash']),
+            'mode': details.get('mode'),
+            'modes': details.get('modes'),
+            'period': period
+        })
+    return entries
+
+
+def upgrade():
+    pgcr_entry = op.create_table('pgcr_entry',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('pgcr', sa.Integer(), nullable=True),
+    sa.Column('character_id', sa.String(), nullable=True),
+    sa.Column('membership_id', sa.String(), nullable=True),
+    sa.Column('team', sa.Integer(), nullable=True),
+    sa.Column('standing', sa.Integer(), nullable=True),
+    sa.Column('score', sa.Integer(), nullable=True),
+    sa.Column('kills', sa.Integer(), nullable=True),
+    sa.Column('deaths', sa.Integer(), nullable=True),
+    sa.Column('completed', sa.Integer(), nullable=True),
+    sa.Column('duration', sa.Integer(), nullable=True),
+    sa.Column('activity_hash', sa.String(), nullable=True),
+    sa.Column('mode', sa.Integer(), nullable=True),
+    sa.Column('modes', postgresql.ARRAY(sa.Integer()), nullable=True),
+    sa.Column('period', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['pgcr'], ['pgcr.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('pgcr', 'character_id')
+    )
+
+    # Backfill before creating the indexes, PGCRs are read in batches of BATCH_SIZE
+    connection = op.get_bind()
+    last_id = 0
+    total = 0
+    while True:
+        rows = connection.execute(sa.text('SELECT id, data, blob FROM pgcr WHERE id > :last_id ORDER BY id LIMIT :limit'), last_id=last_id, limit=BATCH_SIZE).fetchall()
+        if not rows:
+            break
+
+        entries = []
+        for row in rows:
+            report = json.loads(zlib.decompress(bytes(row.blob)).decode('utf-8')) if row.blob is not None else row.data
+            if report:
+                entries.extend(extract_entries(row.id, report))
+        if entries:
+            op.bulk_insert(pgcr_entry, entries)
+
+        last_id = rows[-1].id
+        total = total + len(rows)
+        print(f'Extracted entries from {total} PGCRs')
+
+    op.create_index(op.f('ix_pgcr_entry_pgcr'), 'pgcr_entry', ['pgcr'], unique=False)
+    op.create_index(op.f('ix_pgcr_entry_character_id'), 'pgcr_entry', ['character_id'], unique=False)
+    op.create_index('ix_pgcr_entry_modes', 'pgcr_entry', ['modes'], unique=False, postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_pgcr_entry_modes', table_name='pgcr_entry')
+    op.drop_index(op.f('ix_pgcr_entry_character_id'), table_name='pgcr_entry')
+    op.drop_index(op.f('ix_pgcr_entry_pgcr'), table_name='pgcr_entry')
+    op.drop_table('pgcr_entry')
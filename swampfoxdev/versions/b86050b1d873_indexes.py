@@ -0,0 +1,111 @@
+"""indexes
+
+Revision ID: b86050b1d873
+Revises: dbcfc149ed93
+Create Date: 2026-10-18 13:48:20.563170
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b86050b1d873'
+down_revision = 'dbcfc149ed93'
+branch_labels = None
+depends_on = None
+
+DEFINITION_TABLES = [
+    'DestinyEnemyRaceDefinition',
+    'DestinyPlaceDefinition',
+    'DestinyActivityDefinition',
+    'DestinyActivityTypeDefinition',
+    'DestinyClassDefinition',
+    'DestinyGenderDefinition',
+    'DestinyInventoryBucketDefinition',
+    'DestinyRaceDefinition',
+    'DestinyTalentGridDefinition',
+    'DestinyUnlockDefinition',
+    'DestinyMaterialRequirementSetDefinition',
+    'DestinySandboxPerkDefinition',
+    'DestinyStatGroupDefinition',
+    'DestinyFactionDefinition',
+    'DestinyVendorGroupDefinition',
+    'DestinyRewardSourceDefinition',
+    'DestinyItemCategoryDefinition',
+    'DestinyDamageTypeDefinition',
+    'DestinyActivityModeDefinition',
+    'DestinyMedalTierDefinition',
+    'DestinyAchievementDefinition',
+    'DestinyActivityGraphDefinition',
+    'DestinyCollectibleDefinition',
+    'DestinyStatDefinition',
+    'DestinyItemTierTypeDefinition',
+    'DestinyPresentationNodeDefinition',
+    'DestinyRecordDefinition',
+    'DestinyBondDefinition',
+    'DestinyDestinationDefinition',
+    'DestinyEquipmentSlotDefinition',
+    'DestinyInventoryItemDefinition',
+    'DestinyLocationDefinition',
+    'DestinyLoreDefinition',
+    'DestinyObjectiveDefinition',
+    'DestinyProgressionDefinition',
+    'DestinyProgressionLevelRequirementDefinition',
+    'DestinySackRewardItemListDefinition',
+    'DestinySandboxPatternDefinition',
+    'DestinySeasonDefinition',
+    'DestinySocketCategoryDefinition',
+    'DestinySocketTypeDefinition',
+    'DestinyVendorDefinition',
+    'DestinyMilestoneDefinition',
+    'DestinyActivityModifierDefinition',
+    'DestinyReportReasonCategoryDefinition',
+    'DestinyPlugSetDefinition',
+    'DestinyChecklistDefinition',
+    'DestinyHistoricalStatsDefinition',
+]
+
+INDEXES = [
+    ('player', ['membership_id']),
+    ('playerstats', ['parent_player']),
+    ('raidstats', ['parent_char']),
+    ('character', ['parent_id']),
+    ('character', ['char_id']),
+    ('weapondata', ['match_time']),
+    ('weapon', ['weapon_id']),
+    ('collectibles_player', ['parent_player']),
+    ('collectibles_player', ['parent_collectible']),
+    ('collectibles_game', ['collectible_hash']),
+    ('pgcr', ['date']),
+]
+
+COMPOSITE_INDEXES = [
+    ('ix_weapondata_parent_id_match_time', 'weapondata', ['parent_id', 'match_time']),
+    ('ix_weapondata_parent_weapon_match_time', 'weapondata', ['parent_weapon', 'match_time']),
+    ('ix_pgcr_participant_parent_character_mode_date', 'pgcr_participant', ['parent_character', 'mode', 'date']),
+]
+
+
+def upgrade():
+    for table, columns in INDEXES:
+        op.create_index(op.f(f'ix_{table}_{columns[0]}'), table, columns, unique=False)
+
+    for name, table, columns in COMPOSITE_INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+    # Definitions are not referenced by other tables, so duplicate hashes can simply be dropped
+    for table in DEFINITION_TABLES:
+        op.execute(f'DELETE FROM "{table}" WHERE id NOT IN (SELECT MIN(id) FROM "{table}" GROUP BY hash)')
+        op.create_unique_constraint(f'{table}_hash_key', table, ['hash'])
+
+
+def downgrade():
+    for table in DEFINITION_TABLES:
+        op.drop_constraint(f'{table}_hash_key', table, type_='unique')
+
+    for name, table, columns in COMPOSITE_INDEXES:
+        op.drop_index(name, table_name=table)
+
+    for table, columns in INDEXES:
+        op.drop_index(op.f(f'ix_{table}_{columns[0]}'), table_name=table)
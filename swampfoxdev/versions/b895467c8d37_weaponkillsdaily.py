@@ -0,0 +1,49 @@
+"""weaponkillsdaily
+
+Revision ID: b895467c8d37
+Revises: b86050b1d873
+Create Date: 2026-10-18 14:26:39.750183
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b895467c8d37'
+down_revision = 'b86050b1d873'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('weapon_kills_daily',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=True),
+    sa.Column('parent_id', sa.Integer(), nullable=True),
+    sa.Column('parent_weapon', sa.Integer(), nullable=True),
+    sa.Column('kills', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['parent_id'], ['character.id'], ),
+    sa.ForeignKeyConstraint(['parent_weapon'], ['weapon.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('day', 'parent_id', 'parent_weapon')
+    )
+
+    op.execute("""
+        INSERT INTO weapon_kills_daily (day, parent_id, parent_weapon, kills)
+        SELECT CAST(match_time AS date), parent_id, parent_weapon, SUM(kills)
+        FROM weapondata
+        WHERE match_time IS NOT NULL AND parent_id IS NOT NULL AND parent_weapon IS NOT NULL
+        GROUP BY CAST(match_time AS date), parent_id, parent_weapon
+    """)
+
+    op.create_index(op.f('ix_weapon_kills_daily_day'), 'weapon_kills_daily', ['day'], unique=False)
+    op.create_index('ix_weapon_kills_daily_parent_id_day', 'weapon_kills_daily', ['parent_id', 'day'], unique=False)
+    op.create_index('ix_weapon_kills_daily_parent_weapon_day', 'weapon_kills_daily', ['parent_weapon', 'day'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_weapon_kills_daily_parent_weapon_day', table_name='weapon_kills_daily')
+    op.drop_index('ix_weapon_kills_daily_parent_id_day', table_name='weapon_kills_daily')
+    op.drop_index(op.f('ix_weapon_kills_daily_day'), table_name='weapon_kills_daily')
+    op.drop_table('weapon_kills_daily')
@@ -0,0 +1,117 @@
+"""pgcrblob
+
+Revision ID: cd5467a497f7
+Revises: 8827e19b1762
+Create Date: 2026-10-18 11:47:52.120388
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+import json
+import pickle
+import zlib
+
+
+# revision identifiers, used by Alembic.
+revision = 'cd5467a497f7'
+down_revision = '8827e19b1762'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+
+def slim_report(report, clan_characters):
+    # Same as app.destiny.pgcr.slim_report(), copied so the migration does not depend on the app
+    response = dict(report['Response'])
+    entries = []
+    for entry in response.get('entries', []):
+        if entry.get('characterId') not in clan_characters:
+            entry = {k: v for k, v in entry.items() if k != 'extended'}
+        entries.append(entry)
+    response['entries'] = entries
+    return {'Response': response}
+
+
+def commit():
+    """
+    Commit the migration's transaction and start a new one. Alembic 1.0 has no autocommit_block(), so this is
+    how each batch gets its own transaction and the lock taken by ALTER TABLE pgcr is released during the rewrite.
+    Alembic commits the last transaction, with the final column changes and the new revision, at the end.
+    """
+    connection = op.get_bind()
+    connection.execute(sa.text('COMMIT'))
+    connection.execute(sa.text('BEGIN'))
+
+
+def add_column(column):
+    # Columns added by an earlier run that failed during the rewrite have already been committed
+    if column.name not in [c['name'] for c in sa.inspect(op.get_bind()).get_columns('pgcr')]:
+        op.add_column('pgcr', column)
+
+
+def rewrite_rows(select, update, convert):
+    """
+    Rewrite pgcr in batches of BATCH_SIZE rows, ordered by id, committing each batch.
+    select only returns rows that have not been rewritten yet, so a failed run can be resumed.
+    """
+    connection = op.get_bind()
+    commit()
+    last_id = 0
+    total = 0
+    while True:
+        rows = connection.execute(sa.text(select), last_id=last_id, limit=BATCH_SIZE).fetchall()
+        if not rows:
+            break
+
+        connection.execute(sa.text(update), [convert(row) for row in rows])
+        commit()
+        last_id = rows[-1].id
+        total = total + len(rows)
+        print(f'Rewrote {total} PGCRs')
+
+
+def upgrade():
+    add_column(sa.Column('blob', sa.LargeBinary(), nullable=True))
+    add_column(sa.Column('modes_array', postgresql.ARRAY(sa.Integer()), nullable=True))
+
+    clan_characters = set(row[0] for row in op.get_bind().execute(sa.text('SELECT char_id FROM "character"')))
+
+    def convert(row):
+        return {
+            'id': row.id,
+            'blob': zlib.compress(json.dumps(slim_report(row.data, clan_characters), separators=(',', ':')).encode('utf-8')) if row.data else None,
+            'modes': pickle.loads(bytes(row.modes)) if row.modes is not None else None
+        }
+
+    rewrite_rows(
+        'SELECT id, data, modes FROM pgcr WHERE id > :last_id AND (data IS NOT NULL OR (modes IS NOT NULL AND modes_array IS NULL)) ORDER BY id LIMIT :limit',
+        'UPDATE pgcr SET blob = COALESCE(:blob, blob), modes_array = :modes, data = NULL WHERE id = :id',
+        convert
+    )
+
+    op.drop_column('pgcr', 'modes')
+    op.alter_column('pgcr', 'modes_array', new_column_name='modes')
+
+
+def downgrade():
+    add_column(sa.Column('modes_pickle', sa.LargeBinary(), nullable=True))
+
+    def convert(row):
+        return {
+            'id': row.id,
+            'data': zlib.decompress(bytes(row.blob)).decode('utf-8') if row.blob is not None else json.dumps(row.data),
+            'modes': pickle.dumps(list(row.modes)) if row.modes is not None else None
+        }
+
+    # Extended stats of players outside the clan are not restored
+    rewrite_rows(
+        'SELECT id, data, blob, modes FROM pgcr WHERE id > :last_id AND (blob IS NOT NULL OR (modes IS NOT NULL AND modes_pickle IS NULL)) ORDER BY id LIMIT :limit',
+        'UPDATE pgcr SET data = CAST(:data AS json), modes_pickle = :modes, blob = NULL WHERE id = :id',
+        convert
+    )
+
+    op.drop_column('pgcr', 'modes')
+    op.alter_column('pgcr', 'modes_pickle', new_column_name='modes')
+    op.drop_column('pgcr', 'blob')
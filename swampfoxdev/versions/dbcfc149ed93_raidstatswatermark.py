@@ -0,0 +1,36 @@
+"""raidstatswatermark
+
+Revision ID: dbcfc149ed93
+Revises: 8f6dbda6c7e8
+Create Date: 2026-10-18 13:05:44.291736
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'dbcfc149ed93'
+down_revision = '8f6dbda6c7e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('watermark',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=True),
+    sa.Column('last_id', sa.Integer(), nullable=True),
+    sa.Column('updated', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+
+    # Keep the first row for each raid and character so the unique constraint can be created
+    op.execute("DELETE FROM raidstats WHERE id NOT IN (SELECT MIN(id) FROM raidstats GROUP BY pgcr_id, parent_char)")
+    op.create_unique_constraint('raidstats_pgcr_id_parent_char_key', 'raidstats', ['pgcr_id', 'parent_char'])
+
+
+def downgrade():
+    op.drop_constraint('raidstats_pgcr_id_parent_char_key', 'raidstats', type_='unique')
+    op.drop_table('watermark')
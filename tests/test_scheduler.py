@@ -0,0 +1,32 @@
+from unittest import mock
+import pytest
+
+from app.destiny.client import DestinyAPI
+from app.workers import scheduler
+from config import Config
+
+@pytest.fixture
+def d2():
+    # Autospec'd from the real class, so a job that points at a method DestinyAPI does not have fails here
+    d2 = mock.create_autospec(DestinyAPI, instance=True)
+    d2.get_clan_members_api.return_value = [{'membershipId': 1, 'membershipType': 3, 'isOnline': True}]
+    return d2
+
+def test_get_jobs(d2):
+    jobs = scheduler.get_jobs(d2, scheduler.ClanMembers(d2, Config.SCHEDULER_ROSTER_TTL))
+    assert [job.name for job in jobs] == list(Config.SCHEDULER_INTERVALS)
+    for job in jobs:
+        assert callable(job.func)
+        assert job.interval == Config.SCHEDULER_INTERVALS[job.name]
+
+def test_clan_members_are_shared(d2):
+    clan_members = scheduler.ClanMembers(d2, 60)
+    assert clan_members.get() == clan_members.get()
+    assert d2.get_clan_members_api.call_count == 1
+
+def test_missed_runs_are_skipped():
+    job = scheduler.Job('test', lambda: None, 60, 0)
+    job.planned = job.planned - 300
+    job.schedule()
+    assert job.next_run == job.planned
+    assert 0 < job.next_run - scheduler.time() <= 60
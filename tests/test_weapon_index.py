@@ -0,0 +1,61 @@
+import pytest
+
+from app.destiny import definitions
+from app.destiny import weapon_index
+from config import Config
+
+# 3628991658 has bit 31 set, so its signed hash is negative
+UNSIGNED_HASH = 3628991658
+SIGNED_HASH = -665975638
+KINETIC_BUCKET = 1498876634
+
+class StubStore(object):
+    def __init__(self, tables):
+        self.tables = tables
+
+    def get_all(self, table):
+        return [definitions.Definition(hash=data['hash'], json=data) for data in self.tables.get(table, [])]
+
+def get_weapon(_hash, name, subtype):
+    return {
+        'hash': _hash,
+        'itemType': weapon_index.WEAPON_ITEM_TYPE,
+        'itemTypeDisplayName': subtype,
+        'displayProperties': {'name': name},
+        'inventory': {'bucketTypeHash': KINETIC_BUCKET, 'tierTypeName': 'Legendary'}
+    }
+
+@pytest.fixture
+def index():
+    store = StubStore({
+        'DestinyInventoryBucketDefinition': [{'hash': KINETIC_BUCKET, 'displayProperties': {'name': 'Kinetic Weapons'}}],
+        'DestinyInventoryItemDefinition': [
+            get_weapon(UNSIGNED_HASH, 'Ace of Spades', 'Hand Cannon'),
+            get_weapon(347366834, 'Jotunn', 'Fusion Rifle'),
+            {'hash': 1, 'itemType': 0, 'displayProperties': {'name': 'Not a weapon'}}
+        ]
+    })
+    return weapon_index.WeaponIndex.build('/content/world_sql_content_test.content', store)
+
+def test_get_hash():
+    assert weapon_index.get_hash(UNSIGNED_HASH) == SIGNED_HASH
+    assert weapon_index.get_hash(347366834) == 347366834
+
+def test_build(index):
+    assert len(index) == 2
+    assert index.get(347366834) == weapon_index.WeaponInfo('Jotunn', 'kinetic', 'Fusion Rifle', 'Legendary')
+
+def test_get_signed_hash(index):
+    # DestinyAPI.db_update_match() converts the referenceId once and looks the weapon up by its signed hash
+    weapon = index.get(weapon_index.get_hash(str(UNSIGNED_HASH)))
+    assert weapon == weapon_index.WeaponInfo('Ace of Spades', 'kinetic', 'Hand Cannon', 'Legendary')
+    assert index.get(str(SIGNED_HASH)) == weapon
+
+def test_save_and_load(index, tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'MANIFEST_DIR', str(tmp_path))
+    assert weapon_index.WeaponIndex.load(index.manifest_url) is None
+
+    index.save()
+    loaded = weapon_index.WeaponIndex.load(index.manifest_url)
+    assert loaded.weapons == index.weapons
+    assert loaded.get(SIGNED_HASH).name == 'Ace of Spades'